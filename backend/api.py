@@ -1,41 +1,37 @@
-from google import genai as genai_client
-import google.generativeai as genai
 import os
 import io
+import hmac
+import csv
 import json
+import tempfile
+import threading
+import time
 import re
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from threading import Lock
-from typing import Sequence, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from collections import Counter, defaultdict
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
-from embed import fully_embed, normalize, save_cache, load_cache, convert
-
-# -------------------------------------------------
-# Optional encoding detector (safe if not installed)
-#   pip install charset-normalizer
-# -------------------------------------------------
-try:
-    from charset_normalizer import from_bytes as _cn_from_bytes  # type: ignore
-except Exception:
-    _cn_from_bytes = None
+from embed import fully_embed, normalize
+from corpus import norm_text, tokenize, top_k
+from profiler import PROFILER, profiled, start_from_env
+from singleflight import SingleFlight
+from partitions import PARTITION_COLS
+from similarity import best_two, count_hits
+from ratelimit import BACKGROUND, BULK, GEMINI, INTERACTIVE, is_rate_limited, priority
+from registry import DEFAULT_COLLECTION, Collection, CollectionRegistry, Snapshot, load_collection_specs
+import llm
 
 _WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-+/\.]*")
 
-# --- cosine-safe L2 normalization (even if you've normalized at write-time) ---
-def l2_normalize(mat: np.ndarray) -> np.ndarray:
-    if mat is None:
-        return mat
-    norms = np.linalg.norm(mat, axis=1, keepdims=True) + 1e-12
-    return mat / norms
-
 # --- stronger stoplist to avoid generic "goal/technical/best" tokens showing up ---
 _STOP_EXTRA = {
     "goal","technical","practices","best","ensure","solution","solutions","understand",
@@ -56,6 +52,7 @@ def simple_tokenize(text: str) -> list[str]:
     return [w.lower() for w in _WORD_RE.findall(text or "")]
 
 def build_uncovered_theme_recs(
+    snap: Snapshot,
     uncovered_idxs: np.ndarray,
     k: int = 10,
     min_len_token: int = 3,
@@ -63,8 +60,10 @@ def build_uncovered_theme_recs(
 ) -> list[dict]:
     """
     Rank uncovered 'themes' by demand and return structured recs.
-    If 'uncovered_idxs' is empty, we'll fallback to overall GAP_FREQ-driven themes.
+    If 'uncovered_idxs' is empty, we'll fallback to overall gap_freq-driven themes.
     """
+    reqs_df, reqs_texts = snap.reqs_df, snap.reqs_texts
+
     if stop is None:
         stop = {
             "and","or","the","a","an","for","to","in","on","of","with","by",
@@ -78,8 +77,8 @@ def build_uncovered_theme_recs(
 
     # --- Fallback if nothing to analyze ---
     if uncovered_idxs is None or len(uncovered_idxs) == 0:
-        # Use your global GAP_FREQ as a resilient fallback
-        top = [(w, c) for w, c in GAP_FREQ.most_common(k) if is_good_token(w, min_len_token)]
+        # Use the collection's gap_freq as a resilient fallback
+        top = [(w, c) for w, c in snap.gap_freq.most_common(k) if is_good_token(w, min_len_token)]
         recs = []
         for rank, (tok, cnt) in enumerate(top, start=1):
             # find up to 3 sample requests containing the token
@@ -113,7 +112,7 @@ def build_uncovered_theme_recs(
         toks = [t for t in simple_tokenize(txt)
                 if is_good_token(t, min_len_token)
                 and t not in stop
-                and t not in ACCEL_TOKENS]
+                and t not in snap.accel_tokens]
         uniq = sorted(set(toks))
         req_uncovered_tokens.append(uniq)
         for t in uniq:
@@ -154,233 +153,81 @@ def build_uncovered_theme_recs(
     return recs
 
 
-# -------------------------------------------------
-# Robust CSV loader to tolerate mixed encodings
-# -------------------------------------------------
-def read_csv_robust(
-    path: str,
-    encodings: Sequence[str] = ("utf-8", "utf-8-sig", "cp1252", "latin-1", "iso-8859-1"),
-    **kwargs,
-) -> pd.DataFrame:
-    """
-    Try several encodings, then optional charset detection, then latin-1 fallback.
-    Uses forgiving parser defaults to avoid hard crashes on bad rows.
-    """
-    base_kwargs = dict(
-        dtype=str,              # keep raw strings; parse later if needed
-        keep_default_na=False,  # don't coerce "NA" etc. to NaN
-        on_bad_lines="skip",    # skip malformed lines
-        engine="python",        # more forgiving tokenizer
-    )
-    base_kwargs.update(kwargs)
-
-    # 1) quick encodings
-    for enc in encodings:
-        try:
-            return pd.read_csv(path, encoding=enc, **base_kwargs)
-        except UnicodeDecodeError:
-            continue
-        except FileNotFoundError:
-            raise
-
-    # 2) detect if possible
-    if _cn_from_bytes is not None:
-        with open(path, "rb") as f:
-            raw = f.read()
-        res = _cn_from_bytes(raw).best()
-        if res:
-            try:
-                return pd.read_csv(io.BytesIO(raw), encoding=res.encoding or "utf-8", **base_kwargs)
-            except UnicodeDecodeError:
-                pass
-
-    # 3) final latin-1 pass + NBSP normalization
-    with open(path, "rb") as f:
-        raw = f.read()
-    txt = raw.decode("latin-1")
-    txt = txt.replace("\u00a0", " ")  # NBSP -> space
-    return pd.read_csv(io.StringIO(txt), **base_kwargs)
-
-
 # ---------------------------
 # Setup & Globals
 # ---------------------------
 
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise RuntimeError("Missing GEMINI_API_KEY in environment.")
-client = genai_client.Client(api_key=api_key)
-genai.configure(api_key=api_key)
+client = llm.get_client()  # shared, pooled; used for embeddings and generation
 
 TOP_K = 3
 
-ACCEL_VEC_PATH = "data/accel_vectors.npy"
-ACCEL_TXT_PATH = "data/accel_text.txt"
-
-REQ_VEC_PATH = "data/user_vectors.npy"
-REQ_TXT_PATH = "data/user_text.txt"
+# Retrieval-only fast path (/query?mode=fast or synthesize=auto):
+# skip the LLM when the best accelerator is a clear winner
+FAST_MIN_SCORE  = float(os.getenv("FAST_MIN_SCORE", "0.65"))
+FAST_MIN_MARGIN = float(os.getenv("FAST_MIN_MARGIN", "0.05"))
 
-# Concurrency guard for request logging / embedding updates
-REQ_LOCK = Lock()
+# Background persistence for answers that skip the LLM (serialized per collection anyway)
+PERSIST_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
 
-def _norm_text(s: str) -> str:
-    """Normalize text for dedup: lowercase + collapse whitespace."""
-    return re.sub(r"\s+", " ", (s or "").strip().lower())
+# Identical /query calls already in flight share one embed/retrieve/generate pass
+QUERY_FLIGHT = SingleFlight()
 
 # ---------------------------
-# Load data (robustly)
+# Collections (lazy, LRU under COLLECTION_RAM_MB; see registry.py)
 # ---------------------------
 
-try:
-    accel_df = read_csv_robust("data/accelerators.csv")
-    reqs_df  = read_csv_robust("data/u_hack.csv")
-except FileNotFoundError as e:
-    raise RuntimeError(f"Required CSV not found: {e.filename}") from e
+# 0: serve only the artifacts written by build_index.py, never embed whole corpora in a worker
+INDEX_BUILD_ON_START = os.getenv("INDEX_BUILD_ON_START", "1") != "0"
 
-accel_cols = ['name', 'description']
-reqs_cols  = ["number", "capability", "company", "description", "initiative_title", "primary_category"]
+REGISTRY = CollectionRegistry(client, load_collection_specs(), rebuild=INDEX_BUILD_ON_START)
 
-accel_texts = [convert(row, accel_cols) for _, row in accel_df.iterrows()]
-reqs_texts  = [convert(row, reqs_cols)  for _, row in reqs_df.iterrows()]
+# The default collection (pinned) loads in the background so the worker binds
+# right away; /ready reports 200 only once it's in memory. A failed load (no
+# artifacts yet with INDEX_BUILD_ON_START=0, a 429 during the build, ...) is
+# retried with backoff, so running build_index.py later is picked up.
+WARM_UP_RETRY_S = float(os.getenv("WARM_UP_RETRY_S", "5"))
+WARM_UP_RETRY_MAX_S = float(os.getenv("WARM_UP_RETRY_MAX_S", "120"))
 
-# ---------------------------
-# Token sets (robust read)
-# ---------------------------
+READY = {"status": "loading", "error": None, "attempts": 0, "started_at": time.time(), "ready_at": None}
 
-def _read_lines_robust(path: str) -> list[str]:
-    for enc in ("utf-8", "utf-8-sig", "cp1252", "latin-1", "iso-8859-1"):
+def _warm_up():
+    delay = WARM_UP_RETRY_S
+    while True:
+        READY["attempts"] += 1
         try:
-            with open(path, "r", encoding=enc, errors="strict") as fp:
-                return [ln.rstrip("\n\r") for ln in fp]
-        except UnicodeDecodeError:
-            continue
-    # last resort
-    with open(path, "r", encoding="latin-1", errors="ignore") as fp:
-        return [ln.rstrip("\n\r") for ln in fp]
-
-try:
-    ACCEL_TOKENS = set(_read_lines_robust("data/accel_tokens.txt"))
-except FileNotFoundError:
-    ACCEL_TOKENS = set()
-
-try:
-    REQ_TOKENS = set(_read_lines_robust("data/hack_tokens.txt"))
-except FileNotFoundError:
-    REQ_TOKENS = set()
-
-tokenize = lambda x: set(re.findall(r"[a-z0-9]+", x.lower()))
-
-# ---------------------------
-# Load / ensure caches
-# ---------------------------
-
-accel_embed, accel_cache = load_cache(ACCEL_VEC_PATH, ACCEL_TXT_PATH)
-req_embed,   req_cache   = load_cache(REQ_VEC_PATH, REQ_TXT_PATH)
-
-# Ensure accelerator embeddings
-if accel_embed is None or accel_cache != accel_texts:
-    vec = fully_embed(client, accel_texts, "RETRIEVAL_DOCUMENT", True)
-    vec = normalize(vec)
-    save_cache(ACCEL_VEC_PATH, ACCEL_TXT_PATH, vec, accel_texts)
-    accel_embed, _ = load_cache(ACCEL_VEC_PATH, ACCEL_TXT_PATH)
-
-# Ensure request embeddings
-if req_embed is None or req_cache != reqs_texts:
-    vec = fully_embed(client, reqs_texts, "RETRIEVAL_DOCUMENT", True)
-    vec = normalize(vec)
-    save_cache(REQ_VEC_PATH, REQ_TXT_PATH, vec, reqs_texts)
-    req_embed, _ = load_cache(REQ_VEC_PATH, REQ_TXT_PATH)
-
-# ---------------------------
-# Initial gap frequencies
-# ---------------------------
-
-GAP_FREQ = Counter()
-for text in reqs_texts:
-    toks = tokenize(text)
-    for t in toks:
-        if t in REQ_TOKENS and t not in ACCEL_TOKENS:
-            GAP_FREQ[t] += 1
-
-def top_gap_topics(k: int) -> list[str]:
-    return [w for w, _ in GAP_FREQ.most_common(k)]
-
-# ---------------------------
-# Persistence / Incremental embedding
-# ---------------------------
-
-def persist_user_request(text: str, meta: Optional[dict] = None):
-    """
-    Persist a new user request and update embeddings/caches incrementally.
-
-    Steps:
-    - Deduplicate by normalized text
-    - Append to reqs_texts/reqs_df
-    - Embed only the new text; if dim mismatch, re-embed all
-    - Update caches (npy + txt), token sets, GAP_FREQ
-    - Save CSV back to disk
-    """
-    global reqs_df, reqs_texts, req_embed, REQ_TOKENS, GAP_FREQ
-
-    t_clean = (text or "").strip()
-    if not t_clean:
-        return {"status": "skipped", "reason": "empty"}
-
-    # Dedup
-    nset = {_norm_text(t) for t in reqs_texts}
-    if _norm_text(t_clean) in nset:
-        return {"status": "skipped", "reason": "duplicate"}
-
-    with REQ_LOCK:
-        # ---- 1) Append in memory and DataFrame (keep schema) ----
-        reqs_texts.append(t_clean)
-
-        new_row = {
-            "number": "",
-            "capability": "",
-            "company": "",
-            "description": t_clean,
-            "initiative_title": "",
-            "primary_category": "",
-        }
-        reqs_df = pd.concat([reqs_df, pd.DataFrame([new_row])], ignore_index=True)
-
-        # ---- 2) Embed & update req_embed ----
-        try:
-            new_vec = fully_embed(client, [t_clean], "RETRIEVAL_DOCUMENT", True)
-            new_vec = normalize(new_vec)
+            with REGISTRY.use(DEFAULT_COLLECTION):
+                pass
+            READY.update(status="ready", error=None, ready_at=time.time())
+            return
         except Exception as e:
-            return {"status": "error", "reason": f"embed_failed: {e}"}
-
-        if req_embed is None:
-            req_embed = new_vec
-        else:
-            if new_vec.shape[1] != req_embed.shape[1]:
-                # Mismatch (e.g., model changed) -> re-embed all
-                all_vecs = fully_embed(client, reqs_texts, "RETRIEVAL_DOCUMENT", True)
-                req_embed = normalize(all_vecs)
-            else:
-                req_embed = np.vstack([req_embed, new_vec])
-
-        # ---- 3) Save cache to disk ----
-        save_cache(REQ_VEC_PATH, REQ_TXT_PATH, req_embed, reqs_texts)
-
-        # ---- 4) Update tokens & gap counts ----
-        toks = tokenize(t_clean)
-        REQ_TOKENS.update(toks)
-        for t in toks:
-            if t in REQ_TOKENS and t not in ACCEL_TOKENS:
-                GAP_FREQ[t] += 1
-
-        # ---- 5) Save CSV ----
-        try:
-            reqs_df.to_csv("data/u_hack.csv", index=False, encoding="utf-8")
-        except Exception:
-            # very rare fallback on Windows if a weird char sneaks in
-            reqs_df.to_csv("data/u_hack.csv", index=False, encoding="cp1252")
-
-    return {"status": "ok"}
+            READY.update(status="failed", error=f"{e} (retrying in {delay:.0f}s)")
+        time.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX_S)
+
+threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+def _check_collection(name: str):
+    if name not in REGISTRY.specs:
+        raise HTTPException(404, f"Unknown collection: {name}")
+    if name == DEFAULT_COLLECTION and READY["status"] != "ready":
+        raise HTTPException(503, f"Index {READY['status']}: {READY['error'] or 'see /ready'}")
+    if not REGISTRY.is_loaded(name):
+        # cold collection: load (or build) it off the request thread; clients retry on 503
+        error = REGISTRY.load_async(name)
+        raise HTTPException(503, f"Collection {name} loading: {error or 'retry shortly'}")
+
+def _use_collection(name: str):
+    _check_collection(name)
+    return REGISTRY.use(name)
+
+def _persist_quietly(name: str, text: str, meta: Optional[dict] = None):
+    try:
+        with REGISTRY.use(name) as col, priority(BACKGROUND):
+            col.persist_request(text, meta)
+    except Exception:
+        # don't surface logging failures
+        pass
 
 # ---------------------------
 # FastAPI App
@@ -400,39 +247,285 @@ app.add_middleware(
 def hello():
     return {"message": "hello, world!"}
 
+@app.get("/ready")
+def ready():
+    """Readiness for load balancers: 200 once the default collection is loaded, 503 while loading/building or failed."""
+    body = {
+        **READY,
+        "waited_s": (READY["ready_at"] or time.time()) - READY["started_at"],
+        "loading": REGISTRY.loading(),
+    }
+    return JSONResponse(body, status_code=200 if READY["status"] == "ready" else 503)
+
+@app.get("/collections")
+def collections():
+    return REGISTRY.status()
+
+# ---------------------------
+# Admin: on-demand profiling (per worker)
+# ---------------------------
+
+# admin endpoints exist only when ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def _check_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Not Found")
+    # bytes: compare_digest rejects non-ASCII str, and headers arrive latin-1 decoded
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(403, "Invalid admin token")
+
+@app.get("/admin/profile")
+def profile_status(x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    return PROFILER.status()
+
+@app.post("/admin/profile")
+def profile_start(requests: int = 0, seconds: float = 0.0, x_admin_token: Optional[str] = Header(None)):
+    """
+    Profile the next `requests` calls to /query and /report and/or every call
+    for `seconds`, in whichever worker serves this request.
+    """
+    _check_admin(x_admin_token)
+    try:
+        return PROFILER.start(requests=requests, seconds=seconds)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+
+@app.delete("/admin/profile")
+def profile_stop(x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    return PROFILER.stop()
+
+start_from_env()
+
+@app.get("/admin/gemini")
+def gemini_metrics(x_admin_token: Optional[str] = Header(None)):
+    """Rate-limiter state for this worker: current rate, queue depth and wait times per priority."""
+    _check_admin(x_admin_token)
+    return GEMINI.metrics()
+
 # Optional: manual ingestion endpoint
 class RequestIn(BaseModel):
     text: str
     meta: Optional[dict] = None
 
 @app.post("/requests")
-def add_request(body: RequestIn):
-    res = persist_user_request(body.text, body.meta)
+def add_request(body: RequestIn, collection: str = DEFAULT_COLLECTION):
+    with _use_collection(collection) as col:
+        res = col.persist_request(body.text, body.meta)
     if res.get("status") == "error":
         raise HTTPException(500, res.get("reason", "unknown"))
     return res
 
+BULK_SPOOL_BYTES = 8 * 1024 * 1024  # CSV uploads above this spill to a temp file
+
+def _iter_csv_rows(fp):
+    """Yield dict rows from a binary CSV file object without loading it all."""
+    text = io.TextIOWrapper(fp, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        text.detach()
+
+def _persist_bulk(name: str, items) -> dict:
+    with REGISTRY.use(name) as col, priority(BACKGROUND):
+        return col.persist_requests(items)
+
+@app.post("/requests/bulk")
+async def add_requests_bulk(request: Request, collection: str = DEFAULT_COLLECTION):
+    """
+    Bulk ingestion, one embedding pass per EMBED_BATCH rows and one index/CSV flush.
+
+    Body, by Content-Type:
+      - application/json: ["text", ...], [{"text": ...} | u_hack-style row, ...]
+                          or {"items": [...]}
+      - text/csv:         raw CSV with a header row using u_hack.csv column names
+                          (a free-text "text" column also works), e.g.
+                          curl -X POST --data-binary @export.csv -H 'Content-Type: text/csv' .../requests/bulk
+    """
+    _check_collection(collection)
+    ctype = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+
+    if ctype in ("text/csv", "application/csv", "text/plain"):
+        spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES)
+        try:
+            async for chunk in request.stream():
+                spool.write(chunk)
+            spool.seek(0)
+            return await run_in_threadpool(_persist_bulk, collection, _iter_csv_rows(spool))
+        finally:
+            spool.close()
+
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(400, "Expected a JSON array/object or a text/csv body")
+    items = body.get("items") if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise HTTPException(400, "Expected a JSON array of requests (or {'items': [...]})")
+    return await run_in_threadpool(_persist_bulk, collection, items)
+
+@app.get("/requests/partitions")
+def request_partitions(column: str = "primary_category", collection: str = DEFAULT_COLLECTION):
+    """Distinct (normalized) values of a filter column with their request counts."""
+    if column not in PARTITION_COLS:
+        raise HTTPException(400, f"column must be one of {list(PARTITION_COLS)}")
+    with _use_collection(collection) as col:
+        counts = col.snap.req_parts.values(column)
+    return {"column": column, "values": dict(sorted(counts.items(), key=lambda kv: -kv[1]))}
+
 # Optional: full reindex (if model changed)
 @app.post("/reindex")
-def reindex_requests():
-    global req_embed
+def reindex_requests(collection: str = DEFAULT_COLLECTION):
+    with _use_collection(collection) as col:
+        try:
+            return {"status": "ok", "count": col.reindex_requests()}
+        except Exception as e:
+            raise HTTPException(500, f"reindex_failed: {e}")
+
+_SEARCH_PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND, "bulk": BULK}
+
+@app.get("/search")
+def search(
+    payload: str,
+    corpus: str = "accelerators",
+    k: int = TOP_K,
+    collection: str = DEFAULT_COLLECTION,
+    level: str = Query("background", alias="priority"),
+):
+    """
+    Retrieval only (no LLM, no persistence); used by the CLIs' --server mode.
+
+    priority: Gemini queue for the query embedding. Defaults to "background" so
+    scripted batches queue behind users; a 429 is returned as 429 instead of
+    switching the worker to the local model.
+    """
+    q = (payload or "").strip()
+    if not q:
+        raise HTTPException(400, "Empty query")
+    if corpus not in ("accelerators", "requests"):
+        raise HTTPException(400, "corpus must be 'accelerators' or 'requests'")
+    if level not in _SEARCH_PRIORITIES:
+        raise HTTPException(400, "priority must be 'interactive', 'background' or 'bulk'")
+    with _use_collection(collection) as col:
+        snap = col.snap
+        if corpus == "accelerators":
+            texts, embed, df, title_col = snap.accel_texts, snap.accel_embed, snap.accel_df, col.spec.accel.title_col
+        else:
+            texts, embed, df, title_col = snap.reqs_texts, snap.req_embed, snap.reqs_df, col.spec.reqs.title_col
+
     try:
-        with REQ_LOCK:
-            vec = fully_embed(client, reqs_texts, "RETRIEVAL_DOCUMENT", True)
-            req_embed = normalize(vec)
-            save_cache(REQ_VEC_PATH, REQ_TXT_PATH, req_embed, reqs_texts)
-        return {"status": "ok", "count": len(reqs_texts)}
+        with priority(_SEARCH_PRIORITIES[level]):
+            q_vec = normalize(fully_embed(client, [q], "RETRIEVAL_QUERY", True))
     except Exception as e:
-        raise HTTPException(500, f"reindex_failed: {e}")
+        if is_rate_limited(e):
+            raise HTTPException(429, "Gemini rate limit; retry later", headers={"Retry-After": "5"})
+        raise
+    if q_vec.shape[1] != embed.shape[1]:
+        raise HTTPException(409, "Query/index embedding dims differ; POST /reindex first.")
+    sims = (q_vec @ embed.T)[0]
+    idxs = top_k(sims, max(k, 1))
+    return {
+        "query": q,
+        "matches": [
+            {
+                "rank": rank,
+                "score": float(sims[i]),
+                "text": texts[i],
+                "title": str(df.iloc[i][title_col]) if title_col in df.columns else "",
+            }
+            for rank, i in enumerate(idxs, start=1)
+        ],
+    }
+
+@app.get("/accelerators/{name}/requests")
+def accelerator_requests(name: str, limit: int = 20, collection: str = DEFAULT_COLLECTION):
+    """Closest user requests for one accelerator, served from the maintained reverse index (no matmul)."""
+    with _use_collection(collection) as col:
+        accel_idx = col.accel_index(name)
+        if accel_idx is None:
+            raise HTTPException(404, f"Unknown accelerator: {name}")
+        snap = col.snap
+        reqs_df, reqs_texts = snap.reqs_df, snap.reqs_texts
+        # the index may already hold rows ingested after this snapshot: drop them, then apply limit
+        ids, scores = snap.req_by_accel.top(accel_idx)
+        keep = ids < len(snap.reqs_df)
+        ids, scores = ids[keep][:max(limit, 0)], scores[keep][:max(limit, 0)]
+        title_col = col.spec.reqs.title_col
+        accel_name = str(snap.accel_df.iloc[accel_idx][col.spec.accel.title_col])
+        top_n = snap.req_by_accel.top_n
+
+    rows = []
+    for rank, (i, s) in enumerate(zip(ids, scores), start=1):
+        row = reqs_df.iloc[int(i)]
+        rows.append({
+            "rank": rank,
+            "request_id": int(i),
+            "score": float(s),
+            "title": str(row[title_col]) if title_col in reqs_df.columns else "",
+            "text": reqs_texts[int(i)],
+            **{c: str(row[c]) for c in PARTITION_COLS if c in reqs_df.columns},
+        })
+    return {"accelerator": accel_name, "collection": collection, "top_n": top_n, "requests": rows}
 
 @app.get("/query")
-def query(payload: str, mode: str):
-    global accel_embed, req_embed
+@profiled
+def query(
+    payload: str,
+    mode: str,
+    synthesize: str = "always",
+    primary_category: Optional[str] = None,
+    company: Optional[str] = None,
+    capability: Optional[str] = None,
+    collection: str = DEFAULT_COLLECTION,
+):
+    """
+    collection: which accelerator/request collection to search (see /collections).
+
+    primary_category / company / capability (optional, case-insensitive):
+      restrict the similar-user-request search to matching rows.
+
+    synthesize:
+      - "always": every relevant query goes through the LLM (default)
+      - "auto":   skip the LLM and return a templated answer when the best
+                  accelerator clears FAST_MIN_SCORE and beats the runner-up by
+                  FAST_MIN_MARGIN. mode=fast implies "auto".
+    """
     q = (payload or "").strip()
 
     if not q:
         raise HTTPException(400, "Empty query")
-    
+    if synthesize not in ("always", "auto"):
+        raise HTTPException(400, "synthesize must be 'always' or 'auto'")
+    if mode == "fast":
+        synthesize = "auto"
+
+    _check_collection(collection)
+    filters = {"primary_category": primary_category, "company": company, "capability": capability}
+
+    # Concurrent identical questions (same collection, normalized text, mode, filters) coalesce onto one pass
+    key = (collection, norm_text(q), mode, synthesize, tuple(norm_text(filters[c]) for c in PARTITION_COLS))
+
+    def run():
+        with REGISTRY.use(collection) as col:
+            return _answer_query(col, q, mode, synthesize, filters)
+
+    answer, _ = QUERY_FLIGHT.do(key, run)
+    return JSONResponse(answer)
+
+def _fast_answer(snap: Snapshot, accel_idx: int) -> dict:
+    """Templated answer from the accelerator's own name/description (no LLM)."""
+    row = snap.accel_df.iloc[accel_idx]
+    name = str(row["name"]).strip()
+    desc = str(row["description"]).strip()
+    return {"title": name, "text": f"{name}: {desc}" if desc else name}
+
+def _answer_query(
+    col: Collection, q: str, mode: str, synthesize: str = "always", filters: Optional[dict] = None
+) -> dict:
     results = { 
         "message": None,
         "accelerators": [],
@@ -446,30 +539,34 @@ def query(payload: str, mode: str):
         q_vec = q_vec[None, :]
 
     # Ensure dims match against current caches (rebuild if needed)
-    if q_vec.shape[1] != accel_embed.shape[1]:
-        vec = fully_embed(client, accel_texts, "RETRIEVAL_DOCUMENT", True)
-        vec = normalize(vec)
-        save_cache(ACCEL_VEC_PATH, ACCEL_TXT_PATH, vec, accel_texts)
-        accel_embed, _ = load_cache(ACCEL_VEC_PATH, ACCEL_TXT_PATH)
-
-    if q_vec.shape[1] != req_embed.shape[1]:
-        vec = fully_embed(client, reqs_texts, "RETRIEVAL_DOCUMENT", True)
-        vec = normalize(vec)
-        save_cache(REQ_VEC_PATH, REQ_TXT_PATH, vec, reqs_texts)
-        req_embed, _ = load_cache(REQ_VEC_PATH, REQ_TXT_PATH)
-
-    # Similarities
-    accel_similarities = (q_vec @ accel_embed.T)[0]
-    req_similarities = (q_vec @ req_embed.T)[0]
+    col.ensure_dim(q_vec.shape[1])
 
-    accel_idxs = np.argsort(-accel_similarities)[:TOP_K]
-    req_idxs = np.argsort(-req_similarities)[:TOP_K]
+    # One consistent version for the rest of the request; ingest/reindex publish new ones meanwhile
+    snap = col.snap
+    accel_texts, accel_embed, accel_df = snap.accel_texts, snap.accel_embed, snap.accel_df
+    reqs_texts, req_embed = snap.reqs_texts, snap.req_embed
 
-    accel_best_idx = int(accel_idxs[0])
-    req_best_idx   = int(req_idxs[0])
+    # Similarities (requests: only the partition matching the filters, if any)
+    accel_similarities = (q_vec @ accel_embed.T)[0]
+    accel_idxs = top_k(accel_similarities, TOP_K)
+
+    selected = snap.req_parts.select(req_embed, filters or {})
+    req_ids, req_rows = selected if selected is not None else (None, req_embed)
+    if req_rows.shape[0] > 0:
+        req_similarities = (q_vec @ req_rows.T)[0]
+        local_idxs = top_k(req_similarities, TOP_K)
+        req_best_score = float(req_similarities[local_idxs[0]])
+        req_idxs = req_ids[local_idxs] if req_ids is not None else local_idxs
+    else:
+        req_best_score = -1.0
+        req_idxs = np.empty(0, dtype=int)
 
+    accel_best_idx = int(accel_idxs[0])
     accel_best_score = float(accel_similarities[accel_best_idx])
-    req_best_score   = float(req_similarities[req_best_idx])
+    accel_margin     = (
+        accel_best_score - float(accel_similarities[accel_idxs[1]])
+        if len(accel_idxs) > 1 else accel_best_score
+    )
     
     bad_message = False
 
@@ -503,56 +600,57 @@ def query(payload: str, mode: str):
         use_case_type = "not_relevant"
 
     results["use_case"] = use_case_type
-    results["gap_topics"] = top_gap_topics(7)
+    results["gap_topics"] = snap.top_gap_topics(7)
+
+    # ----- Fast path decision: confident retrieval, no LLM -----
+    synthesis = {
+        "llm": True,
+        "reason": "synthesize_always",
+        "best_score": accel_best_score,
+        "margin": accel_margin,
+    }
+    if synthesize == "auto":
+        if use_case_type == "not_relevant":
+            synthesis["reason"] = "not_relevant"
+        elif accel_best_score < FAST_MIN_SCORE:
+            synthesis["reason"] = "below_min_score"
+        elif accel_margin < FAST_MIN_MARGIN:
+            synthesis["reason"] = "below_min_margin"
+        else:
+            synthesis["llm"] = False
+            synthesis["reason"] = "confident_match"
 
     # ✅ Persist accelerator-relevant queries as user requests
     if use_case_type != "not_relevant":
-        try:
-            persist_user_request(
-                q,
-                meta={
-                    "mode": mode,
-                    "accel_best_score": accel_best_score,
-                    "req_best_score": req_best_score,
-                },
-            )
-        except Exception:
-            # don't block response if logging fails
-            pass
+        meta = {
+            "mode": mode,
+            "accel_best_score": accel_best_score,
+            "req_best_score": req_best_score,
+        }
+        if synthesis["llm"]:
+            try:
+                # background priority: a 429 here must not flip embeddings to the local model
+                with priority(BACKGROUND):
+                    col.persist_request(q, meta=meta)
+            except Exception:
+                # don't block response if logging fails
+                pass
+        else:
+            # fast answers don't wait on the extra document embedding
+            PERSIST_POOL.submit(_persist_quietly, col.name, q, meta)
+
+    if not synthesis["llm"]:
+        fast = _fast_answer(snap, accel_best_idx)
+        return {
+            "text": fast["text"],
+            "title": fast["title"],
+            "use_case": use_case_type,
+            "synthesis": synthesis,
+        }
 
     # ----- LLM synthesis -----
-    system_text = ""
-    if mode == "voice":
-        system_text += (
-            " RESPOND IN PLAIN TEXT ONLY (NO MARKDOWN). "
-            "Then provide a compact JSON OBJECT at the very end with keys {\"title\": string, \"text\": string} "
-            "for the single best accelerator (if any). elaborate a bit on the accelerator for the text field."
-            "If no accelerator is appropriate, use an empty string for \"title\" and still provide \"text\". "
-            "State clearly whether the user's use case is: "
-            "\"existing user request\", \"non existing user request\", or \"not relevant to accelerators or tech at all\". "
-            "If the user asks about accelerators that are in demand but not in the current portfolio, use the provided "
-            "gap topics to discuss the most requested missing areas and suggest next steps. In this case, it would not be a user request, but a non existing one."
-        )
-    else:
-        system_text += (
-            "Provide a compact JSON OBJECT at the very end with keys {\"title\": string, \"text\": string} "
-            "for the single best accelerator (if any). elaborate a bit on the accelerator for the text field."
-            "If no accelerator is appropriate, use an empty string for \"title\" and still provide \"text\". "
-            "State clearly whether the user's use case is: "
-            "\"existing user request\", \"non existing user request\", or \"not relevant to accelerators or tech at all\". "
-            "If the user asks about accelerators that are in demand but not in the current portfolio, use the provided "
-            "gap topics to discuss the most requested missing areas and suggest next steps. In this case, it would not be a user request, but a non existing one."
-        )
-        
-    system_text += "If the query is not relevant, please say: 'This query is not related to accelerators.', and ask for a query related to accelerators. Do not provide the JSON object in this case."
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        system_instruction=system_text
-    )
-
     context = {
-        "user_query": payload,
+        "user_query": q,
         "use_case_hint": results.get("use_case"),
         "top_matching_accelerators": results.get("accelerators", []),
         "top_similar_user_requests": results.get("user_requests", []),
@@ -560,8 +658,7 @@ def query(payload: str, mode: str):
     }
     model_input = json.dumps(context, ensure_ascii=False)
 
-    response = model.generate_content(model_input)
-    generated = (response.text or "").strip()
+    generated = llm.generate(mode, model_input)
 
     title = ""
     try:
@@ -580,50 +677,60 @@ def query(payload: str, mode: str):
 
     use_case = results.get("use_case", "unknown")
 
-    return JSONResponse({
+    return {
         "text": generated,
         "title": title,
-        "use_case": use_case
-    })
+        "use_case": use_case,
+        "synthesis": synthesis,
+    }
 
 @app.get("/report")
-def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
+@profiled
+def report(
+    k: int = 10,
+    threshold: float = 0.15,
+    margin_delta: float = 0.03,
+    primary_category: Optional[str] = None,
+    company: Optional[str] = None,
+    capability: Optional[str] = None,
+    collection: str = DEFAULT_COLLECTION,
+):
     """
+    Optional primary_category / company / capability filters restrict the
+    report to matching user requests (only those rows are scored).
+
     Returns a lean JSON report with:
       - summary
       - coverage (with adaptive threshold/margin if needed)
       - leaderboards.by_hits
       - token_stats
-      - recommendations.top_uncovered_themes (true-uncovered, margin-based weakly-covered, or GAP_FREQ fallback)
+      - recommendations.top_uncovered_themes (true-uncovered, margin-based weakly-covered, or gap_freq fallback)
     """
-    global accel_embed, req_embed
+    with _use_collection(collection) as col:
+        return _build_report(col.name, col.snap, k, threshold, margin_delta, {
+            "primary_category": primary_category, "company": company, "capability": capability,
+        })
+
+def _build_report(name: str, snap: Snapshot, k: int, threshold: float, margin_delta: float, filters: dict):
+    accel_texts, accel_embed, accel_df = snap.accel_texts, snap.accel_embed, snap.accel_df
+    reqs_texts, req_embed = snap.reqs_texts, snap.req_embed
+    REQ_TOKENS, ACCEL_TOKENS = snap.req_tokens, snap.accel_tokens
+
+    selected = snap.req_parts.select(req_embed, filters)
+    req_ids, req_rows = selected if selected is not None else (None, req_embed)
 
     n_accel = len(accel_texts)
-    n_reqs  = len(reqs_texts)
-    if n_accel == 0 or n_reqs == 0:
+    n_reqs  = len(reqs_texts) if req_ids is None else len(req_ids)
+    if n_accel == 0 or len(reqs_texts) == 0:
         raise HTTPException(500, "No data loaded for accelerators or requests.")
+    if n_reqs == 0:
+        raise HTTPException(404, "No user requests match the given filters.")
 
-    # --- cosine-safe normalization (even if already normalized at caching time) ---
-    accel_mat = l2_normalize(accel_embed)
-    req_mat   = l2_normalize(req_embed)
-
-    # --- similarity ---
+    # --- best & second-best per request, blockwise under SIM_MAX_MB (similarity.py) ---
     try:
-        sim = req_mat @ accel_mat.T
+        best_idx, best_scores, second_best = best_two(req_rows, accel_embed)
     except Exception as e:
         raise HTTPException(500, f"Similarity computation failed: {e}")
-
-    # --- best & second-best for margin ---
-    best_idx    = np.argmax(sim, axis=1)
-    best_scores = sim[np.arange(sim.shape[0]), best_idx]
-
-    # partition to get second best efficiently
-    if sim.shape[1] >= 2:
-        part_sorted = np.partition(sim, -2, axis=1)
-        second_best = part_sorted[:, -2]
-    else:
-        # degenerate case: only one accelerator -> second_best = -inf
-        second_best = np.full_like(best_scores, -1e9)
     margins = best_scores - second_best
 
     # --- initial coverage ---
@@ -640,15 +747,15 @@ def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
 
     covered_indices   = np.where(covered_mask)[0]
     uncovered_indices = np.where(~covered_mask)[0]
+    if req_ids is not None:
+        # back to absolute request rows for theme mining
+        uncovered_indices = req_ids[uncovered_indices]
 
     covered_count   = int(covered_mask.sum())
     uncovered_count = int(n_reqs - covered_count)
 
     # --- Leaderboard by hits (kept) ---
-    hits = np.zeros(n_accel, dtype=int)
-    for i, j in enumerate(best_idx):
-        if covered_mask[i]:
-            hits[j] += 1
+    hits = count_hits(best_idx, covered_mask, n_accel)
     hit_order = np.argsort(-hits)[:k]
     leaderboard_by_hits = [
         {"rank": int(rank + 1),
@@ -657,19 +764,21 @@ def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
         for rank, j in enumerate(hit_order) if hits[j] > 0
     ]
 
-    # --- Recommendations: prefer true uncovered; else margin-weak; else GAP_FREQ fallback ---
+    # --- Recommendations: prefer true uncovered; else margin-weak; else gap_freq fallback ---
     recs: list[dict]
     if len(uncovered_indices) > 0:
-        recs = build_uncovered_theme_recs(uncovered_indices, k=k)
+        recs = build_uncovered_theme_recs(snap, uncovered_indices, k=k)
     else:
         # Weakly-covered: best exceeds threshold but margin is small -> ambiguous mapping
         weak_mask = (best_scores >= threshold) & (margins < margin_delta)
         weak_indices = np.where(weak_mask)[0]
+        if req_ids is not None:
+            weak_indices = req_ids[weak_indices]
         if len(weak_indices) > 0:
-            recs = build_uncovered_theme_recs(weak_indices, k=k)
+            recs = build_uncovered_theme_recs(snap, weak_indices, k=k)
         else:
             # final fallback to global gaps
-            recs = build_uncovered_theme_recs(np.array([], dtype=int), k=k)
+            recs = build_uncovered_theme_recs(snap, np.array([], dtype=int), k=k)
 
     # --- Token overlap (kept) ---
     req_only_tokens   = [t for t in (REQ_TOKENS - ACCEL_TOKENS)]
@@ -681,7 +790,7 @@ def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
         "accel_token_count": int(len(ACCEL_TOKENS)),
         "overlap_token_count": int(len(overlap_tokens)),
         "jaccard_overlap": float(len(overlap_tokens) / max(len(REQ_TOKENS | ACCEL_TOKENS), 1)),
-        "top_gap_topics": top_gap_topics(k),
+        "top_gap_topics": snap.top_gap_topics(k),
         "sample_req_only_tokens": req_only_tokens[:k],
         "sample_accel_only_tokens": accel_only_tokens[:k],
     }
@@ -689,9 +798,11 @@ def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
     # --- final report (lean) ---
     report = {
         "summary": {
+            "collection": name,
+            "index_version": snap.version,
             "accelerator_count": int(n_accel),
             "user_request_count": int(n_reqs),
-            "embedding_dim": int(accel_mat.shape[1]),
+            "embedding_dim": int(accel_embed.shape[1]),
         },
         "coverage": {
             "covered_requests": covered_count,
@@ -709,6 +820,7 @@ def report(k: int = 10, threshold: float = 0.15, margin_delta: float = 0.03):
         "debug": {
             "threshold_used": float(threshold),
             "margin_used": float(margin_delta),
+            "filters": {c: v for c, v in filters.items() if v},
         },
         "generated_at": pd.Timestamp.utcnow().isoformat() + "Z",
     }
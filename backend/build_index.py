@@ -0,0 +1,72 @@
+import argparse
+import json
+import sys
+import time
+from threading import Lock
+
+from dotenv import load_dotenv
+
+import llm
+from corpus import load_corpus
+from ratelimit import BULK, priority
+from registry import Collection, build_lock, load_collection_specs
+
+# -------------------------------------------------
+# Offline index build, run before (re)starting the API:
+#
+#   python build_index.py                 # every collection in COLLECTIONS_FILE
+#   python build_index.py default emea    # just these
+#   python build_index.py --force         # re-embed even if caches are fresh
+#
+# Writes each collection's artifacts (accelerator/request vector + text
+# caches, index_meta.json with gap counters). Workers started with
+# INDEX_BUILD_ON_START=0 only load these; otherwise a missing/stale index is
+# rebuilt in the background while /ready reports 503.
+# -------------------------------------------------
+
+load_dotenv()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build embedding/index artifacts for the API.")
+    ap.add_argument("collections", nargs="*", help="collection names (default: all)")
+    ap.add_argument("--force", action="store_true", help="re-embed every corpus even if its cache is fresh")
+    args = ap.parse_args(argv)
+
+    specs = {s.name: s for s in load_collection_specs()}
+    unknown = [n for n in args.collections if n not in specs]
+    if unknown:
+        ap.error(f"unknown collection(s): {', '.join(unknown)}; known: {', '.join(specs)}")
+
+    client = llm.get_client()
+    failed = False
+    for name in args.collections or list(specs):
+        spec = specs[name]
+        t0 = time.perf_counter()
+        try:
+            if args.force:
+                # same lock as the workers, so a running server doesn't embed concurrently
+                with build_lock(), priority(BULK):
+                    for corpus_spec in (spec.accel, spec.reqs):
+                        load_corpus(corpus_spec, client, mmap=False, force=True)
+            # embeds (under build_lock) only what is missing or stale
+            col = Collection(spec, client, Lock())
+            col.save_index_meta()
+            snap = col.snap
+            summary = {
+                "collection": name,
+                "status": "ok",
+                "accelerators": len(snap.accel_texts),
+                "requests": len(snap.reqs_texts),
+                "embedding_dim": int(snap.req_embed.shape[1]),
+                "seconds": round(time.perf_counter() - t0, 2),
+            }
+        except Exception as e:
+            failed = True
+            summary = {"collection": name, "status": "error", "error": str(e)}
+        print(json.dumps(summary), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import argparse
+import http.client
+import json
+import sys
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlencode, urlsplit
+
+from embed import fully_embed, normalize
+from corpus import CorpusSpec, load_corpus, read_tokens, tokenize
+from ratelimit import BULK, priority
+from registry import build_lock
+
+# -------------------------------------------------
+# Shared driver for pipeline.py / request_pipeline.py
+#
+# Interactive (default on a TTY):   python pipeline.py
+# Batch from stdin or files:        python pipeline.py < questions.txt
+#                                   python pipeline.py -f a.txt -f b.txt --format jsonl
+# One-off:                          python pipeline.py -q "incident triage"
+# Against a running server:         python pipeline.py --server http://localhost:8000 < q.txt
+#
+# Local mode loads the same CSV + memory-mapped .npy caches as the API
+# (corpus.py) once, then embeds queries in batches. A missing cache is built
+# under the same lock as build_index.py (prefer running that first).
+# -------------------------------------------------
+
+MIN_SCORE = 0.15
+
+
+class CliProfile:
+    """Per-script wording and domain-token behaviour."""
+
+    def __init__(self, spec: CorpusSpec, prompt: str, header: str, no_match: str,
+                 off_domain: str, skip_off_domain: bool):
+        self.spec = spec
+        self.prompt = prompt
+        self.header = header
+        self.no_match = no_match
+        self.off_domain = off_domain
+        self.skip_off_domain = skip_off_domain
+
+
+def _iter_inputs(args) -> Iterator[str]:
+    for q in args.query or []:
+        yield q
+    for path in args.file or []:
+        fp = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+        try:
+            for line in fp:
+                yield line.rstrip("\n\r")
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+    if not args.query and not args.file and not sys.stdin.isatty():
+        for line in sys.stdin:
+            yield line.rstrip("\n\r")
+
+
+def _iter_interactive(prompt: str) -> Iterator[str]:
+    while True:
+        try:
+            inp = input(prompt)
+        except EOFError:
+            return
+        if not inp:
+            return
+        yield inp
+
+
+def _batched(items: Iterable[str], size: int) -> Iterator[list[str]]:
+    batch = []
+    for it in items:
+        it = it.strip()
+        if not it:
+            continue
+        batch.append(it)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------------------------
+# Backends
+# ---------------------------
+
+class LocalBackend:
+    def __init__(self, spec: CorpusSpec):
+        import llm
+        self.client = llm.get_client()
+        try:
+            self.corpus = load_corpus(spec, self.client, rebuild=False)
+        except RuntimeError:
+            # same lock as the API workers and build_index.py: one process embeds the
+            # shared data/*.npy caches, the others wait and then find them fresh
+            with build_lock(), priority(BULK):
+                self.corpus = load_corpus(spec, self.client)
+
+    def search(self, queries: list[str], k: int) -> list[list[dict]]:
+        q_mat = normalize(fully_embed(self.client, queries, "RETRIEVAL_QUERY", True))
+        if q_mat.ndim == 1:
+            q_mat = q_mat[None, :]
+        if q_mat.shape[1] != self.corpus.embed.shape[1]:
+            with build_lock(), priority(BULK):
+                self.corpus.rebuild(self.client)
+        idx, scores = self.corpus.search(q_mat, k)
+        return [
+            [
+                {"rank": r + 1, "score": float(s), "text": self.corpus.texts[i], "title": self.corpus.title(i)}
+                for r, (i, s) in enumerate(zip(row_i, row_s))
+            ]
+            for row_i, row_s in zip(idx, scores)
+        ]
+
+
+class ServerBackend:
+    """Talks to a running api.py over one keep-alive connection (GET /search)."""
+
+    def __init__(self, spec: CorpusSpec, url: str, collection: str = "default", timeout: float = 30.0):
+        parts = urlsplit(url)
+        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.conn = conn_cls(parts.netloc, timeout=timeout)
+        self.base = parts.path.rstrip("/")
+        self.corpus = spec.name
+        self.collection = collection
+
+    def search(self, queries: list[str], k: int) -> list[list[dict]]:
+        out = []
+        for q in queries:
+            qs = urlencode({"payload": q, "corpus": self.corpus, "collection": self.collection, "k": k})
+            self.conn.request("GET", f"{self.base}/search?{qs}")
+            res = self.conn.getresponse()
+            body = res.read()
+            if res.status != 200:
+                raise RuntimeError(f"server returned {res.status}: {body[:200]!r}")
+            out.append(json.loads(body)["matches"])
+        return out
+
+
+# ---------------------------
+# Output
+# ---------------------------
+
+def _print_text(profile: CliProfile, rec: dict):
+    if rec["status"] == "off_domain":
+        print(f"\n{profile.off_domain}")
+        return
+    if not rec.get("domain_match", True):
+        print(f"\n{profile.off_domain}")
+    if rec["status"] == "no_match":
+        print(f"\n{profile.no_match}")
+        return
+    print(f"\n{profile.header}")
+    for m in rec["matches"]:
+        t = m["text"]
+        print(f"{t[:120]}..." if len(t) > 120 else t[:120])
+
+
+def run(profile: CliProfile, argv: Optional[list[str]] = None):
+    ap = argparse.ArgumentParser(description=f"Search the {profile.spec.name} corpus.")
+    ap.add_argument("-q", "--query", action="append", help="query to run (repeatable)")
+    ap.add_argument("-f", "--file", action="append", help="file with one query per line; '-' for stdin (repeatable)")
+    ap.add_argument("-k", type=int, default=3, help="results per query (default 3)")
+    ap.add_argument("--format", choices=("text", "jsonl"), help="default: text when interactive, jsonl for batch")
+    ap.add_argument("--batch-size", type=int, default=100, help="queries embedded per API call (default 100)")
+    ap.add_argument("--server", help="base URL of a running api.py (e.g. http://localhost:8000)")
+    ap.add_argument("--collection", default="default", help="server-side collection to search (with --server)")
+    args = ap.parse_args(argv)
+
+    interactive = not args.query and not args.file and sys.stdin.isatty()
+    fmt = args.format or ("text" if interactive else "jsonl")
+    # interactive: embed each question as it's typed
+    batch_size = 1 if interactive else max(args.batch_size, 1)
+
+    domain = read_tokens(profile.spec.tokens_path)
+    backend = ServerBackend(profile.spec, args.server, args.collection) if args.server else LocalBackend(profile.spec)
+
+    source = _iter_interactive(profile.prompt) if interactive else _iter_inputs(args)
+    for batch in _batched(source, batch_size):
+        records = []
+        to_search = []
+        for q in batch:
+            rec = {"query": q, "domain_match": bool(tokenize(q) & domain) if domain else True}
+            if not rec["domain_match"] and profile.skip_off_domain:
+                rec.update(status="off_domain", matches=[])
+            else:
+                to_search.append(rec)
+            records.append(rec)
+
+        if to_search:
+            results = backend.search([r["query"] for r in to_search], args.k)
+            for rec, matches in zip(to_search, results):
+                ok = bool(matches) and matches[0]["score"] >= MIN_SCORE
+                rec.update(status="ok" if ok else "no_match", matches=matches if ok else [])
+
+        for rec in records:
+            if fmt == "jsonl":
+                sys.stdout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            else:
+                _print_text(profile, rec)
+        sys.stdout.flush()
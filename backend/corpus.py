@@ -0,0 +1,295 @@
+import csv
+import io
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from embed import cache_line, cache_lock, cache_matches, embed_batched, load_cache, normalize, write_cache
+
+# -------------------------------------------------
+# Shared corpus snapshot: CSV rows -> texts, token set and cached vectors.
+#
+# Used by both the API (api.py) and the CLIs (pipeline.py /
+# request_pipeline.py), so every process reads the same CSVs the same way
+# and reuses the same data/*.npy + data/*_text.txt caches instead of
+# re-embedding on its own.
+# -------------------------------------------------
+
+# Optional encoding detector (safe if not installed)
+#   pip install charset-normalizer
+try:
+    from charset_normalizer import from_bytes as _cn_from_bytes  # type: ignore
+except Exception:
+    _cn_from_bytes = None
+
+
+@dataclass(frozen=True)
+class CorpusSpec:
+    name: str
+    csv_path: str
+    cols: tuple[str, ...]
+    vec_path: str
+    txt_path: str
+    tokens_path: Optional[str] = None
+    title_col: Optional[str] = None
+
+
+ACCEL_SPEC = CorpusSpec(
+    name="accelerators",
+    csv_path="data/accelerators.csv",
+    cols=("name", "description"),
+    vec_path="data/accel_vectors.npy",
+    txt_path="data/accel_text.txt",
+    tokens_path="data/accel_tokens.txt",
+    title_col="name",
+)
+
+REQ_SPEC = CorpusSpec(
+    name="requests",
+    csv_path="data/u_hack.csv",
+    cols=("number", "capability", "company", "description", "initiative_title", "primary_category"),
+    vec_path="data/user_vectors.npy",
+    txt_path="data/user_text.txt",
+    tokens_path="data/hack_tokens.txt",
+    title_col="initiative_title",
+)
+
+
+# Rows load_corpus may embed into an existing cache even when it must not
+# rebuild (INDEX_BUILD_ON_START=0): what other workers ingested but never cached.
+CACHE_TOPUP_MAX = int(os.getenv("CACHE_TOPUP_MAX", "1000"))
+
+
+# -------------------------------------------------
+# Robust CSV loader to tolerate mixed encodings
+# -------------------------------------------------
+def read_csv_robust(
+    path: str,
+    encodings: Sequence[str] = ("utf-8", "utf-8-sig", "cp1252", "latin-1", "iso-8859-1"),
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Try several encodings, then optional charset detection, then latin-1 fallback.
+    Uses forgiving parser defaults to avoid hard crashes on bad rows.
+    """
+    base_kwargs = dict(
+        dtype=str,              # keep raw strings; parse later if needed
+        keep_default_na=False,  # don't coerce "NA" etc. to NaN
+        on_bad_lines="skip",    # skip malformed lines
+        engine="python",        # more forgiving tokenizer
+    )
+    base_kwargs.update(kwargs)
+
+    # 1) quick encodings
+    for enc in encodings:
+        try:
+            return pd.read_csv(path, encoding=enc, **base_kwargs)
+        except UnicodeDecodeError:
+            continue
+        except FileNotFoundError:
+            raise
+
+    # 2) detect if possible
+    if _cn_from_bytes is not None:
+        with open(path, "rb") as f:
+            raw = f.read()
+        res = _cn_from_bytes(raw).best()
+        if res:
+            try:
+                return pd.read_csv(io.BytesIO(raw), encoding=res.encoding or "utf-8", **base_kwargs)
+            except UnicodeDecodeError:
+                pass
+
+    # 3) final latin-1 pass + NBSP normalization
+    with open(path, "rb") as f:
+        raw = f.read()
+    txt = raw.decode("latin-1")
+    txt = txt.replace("\u00a0", " ")  # NBSP -> space
+    return pd.read_csv(io.StringIO(txt), **base_kwargs)
+
+
+def read_lines_robust(path: str) -> list[str]:
+    for enc in ("utf-8", "utf-8-sig", "cp1252", "latin-1", "iso-8859-1"):
+        try:
+            with open(path, "r", encoding=enc, errors="strict") as fp:
+                return [ln.rstrip("\n\r") for ln in fp]
+        except UnicodeDecodeError:
+            continue
+    # last resort
+    with open(path, "r", encoding="latin-1", errors="ignore") as fp:
+        return [ln.rstrip("\n\r") for ln in fp]
+
+
+def read_tokens(path: Optional[str]) -> set[str]:
+    if not path:
+        return set()
+    try:
+        return set(read_lines_robust(path))
+    except FileNotFoundError:
+        return set()
+
+
+tokenize = lambda x: set(re.findall(r"[a-z0-9]+", x.lower()))
+
+
+def norm_text(s: str) -> str:
+    """Normalize text for dedup: lowercase + collapse whitespace."""
+    return re.sub(r"\s+", " ", (s or "").strip().lower())
+
+
+def corpus_texts(df: pd.DataFrame, cols: Sequence[str]) -> list[str]:
+    """
+    Column-wise equivalent of [convert(row, cols) for _, row in df.iterrows()]:
+    stripped, non-empty cell values joined with " | ".
+    """
+    if len(df) == 0:
+        return []
+    parts = [df[c].fillna("").astype(str).str.strip() for c in cols]
+    return [" | ".join(p for p in row if p) for row in zip(*parts)]
+
+
+def append_csv_rows(path: str, rows: list[dict], cols: Sequence[str]):
+    """
+    Append rows to a CSV in one write + fsync, instead of rewriting the whole file.
+    Columns follow the file's existing header (or `cols` for a new file).
+    """
+    if not rows:
+        return
+    fieldnames, needs_newline = list(cols), False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+            fieldnames = next(csv.reader(f), None) or fieldnames
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) not in (b"\n", b"\r")
+    else:
+        needs_newline = None  # new file -> header first
+
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore", lineterminator="\n")
+        if needs_newline is None:
+            writer.writeheader()
+        elif needs_newline:
+            f.write("\n")
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def top_k(sims: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (argpartition instead of a full sort)."""
+    k = min(k, sims.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    idx = np.argpartition(-sims, k - 1)[:k]
+    return idx[np.argsort(-sims[idx])]
+
+
+def top_k_rows(sims: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top_k for a (n_queries, n_docs) score matrix -> (n_queries, k) indices."""
+    k = min(k, sims.shape[1])
+    if k <= 0:
+        return np.empty((sims.shape[0], 0), dtype=int)
+    idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sims, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+# ---------------------------
+# Snapshot
+# ---------------------------
+
+class Corpus:
+    """One loaded corpus: DataFrame, row texts, token set and (n, d) unit vectors."""
+
+    def __init__(self, spec: CorpusSpec, df: pd.DataFrame, texts: list[str], embed, tokens: set[str]):
+        self.spec = spec
+        self.df = df
+        self.texts = texts
+        self.embed = embed
+        self.tokens = tokens
+
+    def title(self, i: int) -> str:
+        if self.spec.title_col and self.spec.title_col in self.df.columns:
+            return str(self.df.iloc[int(i)][self.spec.title_col])
+        return ""
+
+    def rebuild(self, client):
+        """Re-embed every row and rewrite the cache (e.g. after a model/dim change)."""
+        vec = normalize(embed_batched(client, self.texts, "RETRIEVAL_DOCUMENT", True))
+        write_cache(self.spec.vec_path, self.spec.txt_path, vec, self.texts)
+        self.embed = vec
+
+    def top_up(self, client, vec: np.ndarray, cache: list[str]) -> bool:
+        """
+        Reuse cached vectors by text and embed only the rows the cache lacks
+        (e.g. rows another worker added to the CSV but not yet to the cache),
+        then rewrite the cache in CSV order. False if the new rows come back in
+        another dimension (model changed): nothing is written, a rebuild is needed.
+        """
+        vec = np.asarray(vec, dtype=np.float32)
+        row_of = {t: i for i, t in enumerate(cache)}
+        src = np.array([row_of.get(cache_line(t), -1) for t in self.texts], dtype=np.int64)
+        hit, missing = np.flatnonzero(src >= 0), np.flatnonzero(src < 0)
+        out = np.empty((len(self.texts), vec.shape[1]), dtype=np.float32)
+        out[hit] = vec[src[hit]]
+        if len(missing):
+            new = normalize(embed_batched(client, [self.texts[i] for i in missing], "RETRIEVAL_DOCUMENT", True))
+            if new.shape[1] != vec.shape[1]:
+                return False
+            out[missing] = new
+        write_cache(self.spec.vec_path, self.spec.txt_path, out, self.texts, base=cache)
+        self.embed = out
+        return True
+
+    def search(self, q_mat: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """(n_queries, k) indices and scores for a batch of unit query vectors."""
+        sims = q_mat @ self.embed.T
+        idx = top_k_rows(sims, k)
+        return idx, np.take_along_axis(sims, idx, axis=1)
+
+
+def load_corpus(spec: CorpusSpec, client=None, rebuild: bool = True, mmap: bool = True, force: bool = False) -> Corpus:
+    """
+    Read the CSV + token file and attach cached vectors.
+    The .npy cache is memory-mapped read-only by default, so processes on the
+    same host share the page cache instead of each holding a private copy.
+    If the cache lacks some rows, only those are embedded with `client` (up to
+    CACHE_TOPUP_MAX rows unless `rebuild` is set). If it is missing or unusable
+    and `rebuild` is set, every row is re-embedded (`force`: regardless).
+    """
+    try:
+        df = read_csv_robust(spec.csv_path)
+    except FileNotFoundError as e:
+        raise RuntimeError(f"Required CSV not found: {e.filename}") from e
+
+    texts = corpus_texts(df, spec.cols)
+    tokens = read_tokens(spec.tokens_path)
+
+    with cache_lock(spec.vec_path):  # never read a vector/text pair mid-replace
+        embed, cache = load_cache(spec.vec_path, spec.txt_path, mmap=mmap)
+    if embed is not None:
+        n = min(len(embed), len(cache))
+        embed, cache = embed[:n], cache[:n]
+    corpus = Corpus(spec, df, texts, embed, tokens)
+
+    if not force and embed is not None and cache_matches(cache, texts):
+        corpus.embed = embed[:len(texts)]  # rows appended by other workers after our CSV read
+        return corpus
+
+    stale = RuntimeError(f"Embedding cache for '{spec.name}' is missing or stale: {spec.vec_path}")
+    if client is None:
+        raise stale
+    if not force and embed is not None and len(embed):
+        cached = set(cache)
+        missing = sum(1 for t in texts if cache_line(t) not in cached)
+        if (rebuild or missing <= CACHE_TOPUP_MAX) and corpus.top_up(client, embed, cache):
+            return corpus
+    if not (rebuild or force):
+        raise stale
+    corpus.rebuild(client)
+    return corpus
@@ -1,12 +1,25 @@
 import os
+import tempfile
+from contextlib import contextmanager
 import numpy as np
 from google import genai
 import pandas as pd
 
+from ratelimit import GEMINI, INTERACTIVE, current_priority, is_rate_limited
+
+# Optional cross-process file locks (safe if unavailable, e.g. Windows)
+try:
+    import fcntl  # type: ignore
+except ImportError:
+    fcntl = None
+
 LOCAL_MODEL = None
 EMBED_BACKEND = "gemini"
 BACKEND_LOCKED = False
 
+# texts per embed_content call when embedding many rows
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "100"))
+
 # various helpers :)
 
 def use_model():
@@ -18,11 +31,12 @@ def use_model():
     return LOCAL_MODEL
 
 def gemini_model(client, texts, task):
-    res = client.models.embed_content(
+    # admitted by the shared priority bucket (ratelimit.py); 429s retried there
+    res = GEMINI.call(lambda: client.models.embed_content(
         model="gemini-embedding-001",
         contents=texts,
         config=genai.types.EmbedContentConfig(task_type=task),
-    )
+    ))
     return np.array([np.array(e.values, dtype=np.float32) for e in res.embeddings])
 
 def local_embedding(texts):
@@ -41,7 +55,10 @@ def fully_embed(client, texts, task, use_local=True):
             vec = gemini_model(client, texts, task)
             BACKEND_LOCKED = True
             return vec
-        except Exception:
+        except Exception as e:
+            if is_rate_limited(e) and current_priority() != INTERACTIVE:
+                # background/bulk quota pressure must not switch every user to the local model
+                raise
             if use_local:
                 print("gemini rate limited... falling back to local and locking backend")
                 EMBED_BACKEND = "local"
@@ -50,7 +67,21 @@ def fully_embed(client, texts, task, use_local=True):
             raise
     BACKEND_LOCKED = True
     return local_embedding(texts)
-        
+
+def embed_batched(client, texts, task, use_local=True, batch_size=None):
+    """
+    fully_embed in chunks of EMBED_BATCH texts (one API call each).
+    If the backend falls back to local part-way, re-embed everything so all
+    rows share one model/dimension.
+    """
+    size = max(batch_size or EMBED_BATCH, 1)
+    if len(texts) <= size:
+        return fully_embed(client, texts, task, use_local)
+    parts = [fully_embed(client, texts[i:i + size], task, use_local) for i in range(0, len(texts), size)]
+    if len({p.shape[1] for p in parts}) > 1:
+        return fully_embed(client, texts, task, use_local)
+    return np.vstack(parts)
+
 def convert(row, cols):
     parts = []
     for c in cols:
@@ -58,21 +89,124 @@ def convert(row, cols):
             parts.append(str(row[c]).strip())
     return " | ".join(parts)
 
+def cache_line(text):
+    """How a text is stored in the *_text.txt cache (one line per row)."""
+    return text.replace("\r", " ").replace("\n", " ").strip()
+
+def cache_matches(cache, texts):
+    """
+    True if a loaded text cache still describes `texts` (same rows, same order).
+    Extra trailing cache rows are allowed: another process may have appended
+    rows (or a CSV append failed after its cache append); callers use the prefix.
+    """
+    if cache is None or len(cache) < len(texts):
+        return False
+    return all(c == cache_line(t) for c, t in zip(cache, texts))
+
+@contextmanager
+def file_lock(path):
+    """Exclusive across processes on this host (no-op without fcntl); threads each open their own handle."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def cache_lock(vec_path):
+    """
+    Held around every read-modify-write of one vector + text cache pair (and the
+    CSV append that goes with it), so workers sharing data/ never overwrite
+    each other's rows or read a half-replaced pair.
+    """
+    return file_lock(vec_path + ".lock")
+
 def save_cache(vec_path, text_path, vec, texts):
-    os.makedirs(os.path.dirname(vec_path), exist_ok=True)
-    np.save(vec_path, vec)
-    with open(text_path, "w", encoding="utf-8") as f:
-        for t in texts:
-            f.write(t.replace("\n", " ").strip() + "\n")
+    # replaces the whole cache: callers hold cache_lock and go through write_cache/append_cache
+    # write-then-rename so readers holding the old file (e.g. via mmap) never see a torn write
+    # temp names are unique per call (workers share data/), in the same directory so os.replace stays atomic
+    os.makedirs(os.path.dirname(vec_path) or ".", exist_ok=True)
+    fd_vec, tmp_vec = tempfile.mkstemp(prefix=os.path.basename(vec_path) + ".", suffix=".tmp",
+                                       dir=os.path.dirname(vec_path) or ".")
+    fd_txt, tmp_txt = tempfile.mkstemp(prefix=os.path.basename(text_path) + ".", suffix=".tmp",
+                                       dir=os.path.dirname(text_path) or ".")
+    try:
+        for tmp in (tmp_vec, tmp_txt):
+            os.chmod(tmp, 0o644)  # mkstemp creates 0600; keep the caches readable like before
+        with os.fdopen(fd_vec, "wb") as f:
+            np.save(f, np.asarray(vec, dtype=np.float32))
+        with os.fdopen(fd_txt, "w", encoding="utf-8") as f:
+            for t in texts:
+                f.write(cache_line(t) + "\n")
+        os.replace(tmp_vec, vec_path)
+        os.replace(tmp_txt, text_path)
+    except BaseException:
+        for tmp in (tmp_vec, tmp_txt):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
 
-def load_cache(vec_path, text_path):
+def load_cache(vec_path, text_path, mmap=False):
     if not (os.path.exists(vec_path) and os.path.exists(text_path)):
         return None, None
 
-    vec = np.load(vec_path)
+    vec = np.load(vec_path, mmap_mode="r" if mmap else None)
 
     with open(text_path, "r", encoding="utf-8") as f:
         texts = [line.rstrip("\n") for line in f]
     return vec, texts
 
+def _disk_cache(vec_path, text_path):
+    """The cache as it is on disk now (caller holds cache_lock); rows beyond the shorter file are dropped."""
+    vec, texts = load_cache(vec_path, text_path)
+    if vec is None:
+        return None, None
+    n = min(len(vec), len(texts))
+    return vec[:n], texts[:n]
+
+def append_cache(vec_path, text_path, vec, texts):
+    """
+    Add rows to the cache as it is on disk, not as this process last loaded it:
+    other workers may have appended their own rows since. Texts already cached
+    are skipped. Caller holds cache_lock(vec_path).
+    Returns False (writing nothing) if the cache on disk has another dimension;
+    the next load_corpus embeds whatever the cache lacks.
+    """
+    disk_vec, disk_texts = _disk_cache(vec_path, text_path)
+    if disk_vec is None:
+        save_cache(vec_path, text_path, vec, texts)
+        return True
+    if disk_vec.shape[1] != vec.shape[1]:
+        return False
+    have = set(disk_texts)
+    keep = [i for i, t in enumerate(texts) if cache_line(t) not in have]
+    if keep:
+        save_cache(vec_path, text_path, np.vstack([disk_vec, np.asarray(vec)[keep]]),
+                   disk_texts + [texts[i] for i in keep])
+    return True
 
+def write_cache(vec_path, text_path, vec, texts, base=None):
+    """
+    Replace the cache with `vec`/`texts` (a rebuild, top-up or reindex) without
+    dropping rows other workers appended meanwhile. `base` is the text cache
+    this process read before embedding: if the disk still starts with it, only
+    the rows after it are carried over (stale ones are dropped); otherwise every
+    same-dimension row whose text isn't in `texts` is. Takes cache_lock.
+    """
+    with cache_lock(vec_path):
+        disk_vec, disk_texts = _disk_cache(vec_path, text_path)
+        extra = []
+        if disk_vec is not None and disk_vec.shape[1] == np.shape(vec)[1]:
+            start = 0
+            if base is not None and disk_texts[:len(base)] == list(base):
+                start = len(base)
+            ours = {cache_line(t) for t in texts}
+            extra = [i for i in range(start, len(disk_texts)) if disk_texts[i] not in ours]
+        if extra:
+            vec = np.vstack([np.asarray(vec, dtype=np.float32), disk_vec[extra]])
+            texts = list(texts) + [disk_texts[i] for i in extra]
+        save_cache(vec_path, text_path, vec, texts)
@@ -0,0 +1,110 @@
+import os
+from threading import Lock
+from typing import Optional
+
+from google import genai
+from google.genai import types
+
+from ratelimit import GEMINI
+
+# -------------------------------------------------
+# One long-lived Gemini client per worker.
+#
+# The client owns a pooled httpx connection (keep-alive), so TLS setup and
+# object construction are paid once at startup instead of on every request.
+# Per-mode generation configs (system prompts) are also built once.
+# Every call goes through the shared rate limiter in ratelimit.py.
+#
+# Tunables (env):
+#   LLM_MODEL            generation model        (default gemini-2.5-flash)
+#   LLM_TIMEOUT_S        per-call HTTP timeout   (default 30)
+#   LLM_RETRIES          attempts incl. first    (default 3)
+#   LLM_MAX_CONNECTIONS  pooled connections      (default 20)
+# -------------------------------------------------
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+# 429s are retried by the rate limiter (ratelimit.py) so the backoff is shared across calls
+_RETRY_STATUS = [408, 500, 502, 503, 504]
+
+# ---------------------------
+# System prompts (built once)
+# ---------------------------
+
+_ANSWER_RULES = (
+    "a compact JSON OBJECT at the very end with keys {\"title\": string, \"text\": string} "
+    "for the single best accelerator (if any). elaborate a bit on the accelerator for the text field."
+    "If no accelerator is appropriate, use an empty string for \"title\" and still provide \"text\". "
+    "State clearly whether the user's use case is: "
+    "\"existing user request\", \"non existing user request\", or \"not relevant to accelerators or tech at all\". "
+    "If the user asks about accelerators that are in demand but not in the current portfolio, use the provided "
+    "gap topics to discuss the most requested missing areas and suggest next steps. In this case, it would not be a user request, but a non existing one."
+)
+
+_NOT_RELEVANT_RULE = (
+    "If the query is not relevant, please say: 'This query is not related to accelerators.', "
+    "and ask for a query related to accelerators. Do not provide the JSON object in this case."
+)
+
+SYSTEM_PROMPTS = {
+    "voice": " RESPOND IN PLAIN TEXT ONLY (NO MARKDOWN). Then provide " + _ANSWER_RULES + _NOT_RELEVANT_RULE,
+    "default": "Provide " + _ANSWER_RULES + _NOT_RELEVANT_RULE,
+}
+
+# ---------------------------
+# Client / configs
+# ---------------------------
+
+_client: Optional[genai.Client] = None
+_configs: dict[str, types.GenerateContentConfig] = {}
+_init_lock = Lock()
+
+
+def _http_options() -> types.HttpOptions:
+    client_args = {}
+    try:
+        import httpx
+        client_args["limits"] = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=60.0,
+        )
+    except ImportError:
+        pass
+
+    return types.HttpOptions(
+        timeout=int(LLM_TIMEOUT_S * 1000),  # milliseconds
+        retry_options=types.HttpRetryOptions(
+            attempts=max(LLM_RETRIES, 1),
+            initial_delay=0.5,
+            max_delay=8.0,
+            http_status_codes=_RETRY_STATUS,
+        ),
+        client_args=client_args or None,
+    )
+
+
+def get_client() -> genai.Client:
+    """Shared client for embeddings and generation (created on first use)."""
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("Missing GEMINI_API_KEY in environment.")
+                for mode, prompt in SYSTEM_PROMPTS.items():
+                    _configs[mode] = types.GenerateContentConfig(system_instruction=prompt)
+                _client = genai.Client(api_key=api_key, http_options=_http_options())
+    return _client
+
+
+def generate(mode: str, contents: str) -> str:
+    """Run one generation with the prebuilt config for `mode` ("voice" or anything else)."""
+    client = get_client()
+    config = _configs["voice" if mode == "voice" else "default"]
+    response = GEMINI.call(lambda: client.models.generate_content(model=LLM_MODEL, contents=contents, config=config))
+    return (response.text or "").strip()
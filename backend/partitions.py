@@ -0,0 +1,139 @@
+import os
+import re
+from threading import Lock
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# -------------------------------------------------
+# Metadata partitions for filtered search over the request corpus.
+#
+# For every filterable column we keep, per distinct value, the (ascending)
+# row ids that carry it. Columns listed in PARTITION_MATRIX_COLS also keep a
+# contiguous copy of those rows' vectors, so a filtered query is a single
+# matmul over exactly the matching rows. Both grow in place (amortized
+# doubling) when requests are ingested.
+# -------------------------------------------------
+
+PARTITION_COLS = ("primary_category", "company", "capability")
+PARTITION_MATRIX_COLS = tuple(
+    c.strip() for c in os.getenv("PARTITION_MATRIX_COLS", "primary_category").split(",") if c.strip()
+)
+
+
+def partition_key(value) -> str:
+    """Case/whitespace-insensitive partition key ("Technical and business Strategy" == "...Business...")."""
+    return re.sub(r"\s+", " ", str(value or "").strip().lower())
+
+
+class _Partition:
+    __slots__ = ("_ids", "_mat", "_n", "view")
+
+    def __init__(self, with_matrix: bool):
+        self._ids = np.empty(16, dtype=np.int64)
+        self._mat = np.empty((0, 0), dtype=np.float32) if with_matrix else None
+        self._n = 0
+        # (ids, mat-or-None) published as one tuple so readers never see a torn append
+        self.view = (self._ids[:0], None if self._mat is None else self._mat[:0])
+
+    def extend(self, ids: np.ndarray, vecs: Optional[np.ndarray]):
+        n_new = self._n + len(ids)
+        if n_new > len(self._ids):
+            cap = max(n_new, 2 * len(self._ids))
+            grown = np.empty(cap, dtype=np.int64)
+            grown[:self._n] = self._ids[:self._n]
+            self._ids = grown
+        self._ids[self._n:n_new] = ids
+
+        if self._mat is not None:
+            dim = vecs.shape[1]
+            if self._mat.shape[1] != dim or n_new > self._mat.shape[0]:
+                cap = max(n_new, 2 * self._mat.shape[0], 16)
+                grown = np.empty((cap, dim), dtype=np.float32)
+                if self._mat.shape[1] == dim:
+                    grown[:self._n] = self._mat[:self._n]
+                self._mat = grown
+            self._mat[self._n:n_new] = vecs
+
+        self._n = n_new
+        self.view = (self._ids[:n_new], None if self._mat is None else self._mat[:n_new])
+
+
+class PartitionIndex:
+    def __init__(self, columns: Sequence[str] = PARTITION_COLS, matrix_cols: Sequence[str] = PARTITION_MATRIX_COLS):
+        self.columns = tuple(columns)
+        self.matrix_cols = {c for c in matrix_cols if c in self.columns}
+        self._parts: dict[str, dict[str, _Partition]] = {c: {} for c in self.columns}
+        self._lock = Lock()
+
+    def build(self, df: pd.DataFrame, embed: np.ndarray):
+        """Rebuild every partition from scratch (startup, reindex, dim change)."""
+        fresh = PartitionIndex(self.columns, self.matrix_cols)
+        fresh.add(df, 0, embed)
+        with self._lock:
+            self._parts = fresh._parts
+
+    def add(self, df: pd.DataFrame, start: int, vecs: np.ndarray):
+        """Index rows start..start+len(df)-1; `df`/`vecs` hold just those rows."""
+        if len(df) == 0:
+            return
+        vecs = np.asarray(vecs, dtype=np.float32)
+        with self._lock:
+            for col in self.columns:
+                if col not in df.columns:
+                    continue
+                keys = df[col].map(partition_key).to_numpy()
+                parts = self._parts[col]
+                for key in pd.unique(keys):
+                    if not key:
+                        continue
+                    local = np.flatnonzero(keys == key)
+                    part = parts.get(key)
+                    if part is None:
+                        part = parts[key] = _Partition(col in self.matrix_cols)
+                    part.extend(local + start, vecs[local] if col in self.matrix_cols else None)
+
+    def nbytes(self) -> int:
+        # copy under the lock: add() inserts new keys while ingest runs
+        with self._lock:
+            parts = [p for col_parts in self._parts.values() for p in col_parts.values()]
+        return sum(p._ids.nbytes + (p._mat.nbytes if p._mat is not None else 0) for p in parts)
+
+    def values(self, col: str) -> dict[str, int]:
+        with self._lock:
+            parts = list(self._parts.get(col, {}).items())
+        return {k: len(p.view[0]) for k, p in parts}
+
+    def select(self, embed: np.ndarray, filters: dict[str, str]) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """
+        (row_ids, vectors) for rows matching every filter, or None when no
+        filter is set. Scans start from the smallest matching partition.
+        """
+        active = {c: partition_key(v) for c, v in filters.items() if v and c in self.columns}
+        if not active:
+            return None
+
+        views = []
+        for col, key in active.items():
+            part = self._parts[col].get(key)
+            if part is None:
+                return np.empty(0, dtype=np.int64), embed[:0]
+            views.append((col, part.view))
+        views.sort(key=lambda cv: len(cv[1][0]))
+
+        _, (ids, mat) = views[0]
+        mask = None
+        if len(views) > 1:
+            mask = np.ones(len(ids), dtype=bool)
+            for _, (other_ids, _) in views[1:]:
+                mask &= np.isin(ids, other_ids, assume_unique=True)
+        if len(ids) and ids[-1] >= embed.shape[0]:
+            # rows indexed after the caller's `embed` was read
+            mask = (ids < embed.shape[0]) if mask is None else mask & (ids < embed.shape[0])
+        if mask is not None:
+            ids = ids[mask]
+            mat = mat[mask] if mat is not None else None
+        if mat is None:
+            mat = embed[ids]
+        return ids, mat
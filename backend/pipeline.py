@@ -1,77 +1,18 @@
-from google import genai
-import os
-import numpy as np
-import pandas as pd
 from dotenv import load_dotenv
-import re
 
-from embed import fully_embed, normalize, save_cache, load_cache, convert
+from cli import CliProfile, run
+from corpus import ACCEL_SPEC
 
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client()
 
-TOP_K = 3
-VEC_PATH = "data/accel_vectors.npy"
-TXT_PATH = "data/accel_text.txt"
-
-try:
-    df = pd.read_csv("data/accelerators.csv", encoding="utf-8")
-except UnicodeDecodeError:
-    df = pd.read_csv("data/accelerators.csv", encoding="cp1252")
-
-texts = []
-cols = ['name', 'description']
-
-texts = [convert(row, cols) for _, row in df.iterrows()]
-
-DOMAIN_TOKENS = {}
-
-with open("data/accel_tokens.txt", "r") as fp:
-    tokens = fp.read().splitlines()
-    DOMAIN_TOKENS = set(tokens)
-
-tokenize = lambda s: set(re.findall(r"[a-z0-9]+", s.lower()))
-
-embeddings_matrix, cache = load_cache(VEC_PATH, TXT_PATH)
-
-if embeddings_matrix is None or cache != texts:
-    vec = fully_embed(client, texts, "RETRIEVAL_DOCUMENT", True)
-    vec = normalize(vec)
-
-    save_cache(VEC_PATH, TXT_PATH, vec, texts) 
-    embeddings_matrix, _ = load_cache(VEC_PATH, TXT_PATH)
-
-while True:
-    inp = input("Ask a question: ")
-    if not inp: break
-
-    if not (tokenize(inp) & DOMAIN_TOKENS):
-        print("\nWe don't seem to have an accelerator for this use case yet!")
-        continue
-
-    q_vec = fully_embed(client, [inp], "RETRIEVAL_QUERY", True)
-    q_vec = normalize(q_vec)
-
-    if q_vec.shape[1] != embeddings_matrix.shape[1]:
-        vec = fully_embed(client, texts, "RETRIEVAL_DOCUMENT", True)
-        vec = normalize(vec)
-        save_cache(VEC_PATH, TXT_PATH, vec, texts)
-        embeddings_matrix, _ = load_cache(VEC_PATH, TXT_PATH)
-
-    similarities = (q_vec @ embeddings_matrix.T)[0]
-    idxs = np.argsort(-similarities)[:TOP_K]
-
-    best_idx = int(idxs[0])
-    best_score = float(similarities[best_idx])
-
-    if best_score < 0.15:
-        print("\nWe dont seem to have an accelerator for this use case yet!")
-        continue
-
-    print("\nThe best accelerators for you are:")
-    for i in idxs:
-        if len(texts[i]) > 120:
-            print(f"{texts[i][:120]}...")
-        else:
-            print(f"{texts[i][:120]}")
\ No newline at end of file
+PROFILE = CliProfile(
+    spec=ACCEL_SPEC,
+    prompt="Ask a question: ",
+    header="The best accelerators for you are:",
+    no_match="We dont seem to have an accelerator for this use case yet!",
+    off_domain="We don't seem to have an accelerator for this use case yet!",
+    skip_off_domain=True,
+)
+
+if __name__ == "__main__":
+    run(PROFILE)
@@ -0,0 +1,254 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+# -------------------------------------------------
+# On-demand sampling profiler for live workers
+#
+# Opt-in only. Start a session with either:
+#   PROFILE_REQUESTS=N   -> profile the next N wrapped requests on boot
+#   PROFILE_SECONDS=T    -> profile every wrapped request for T seconds on boot
+# or at runtime through POST /admin/profile (see api.py).
+#
+# Each session writes, per worker (pid in the file name), into PROFILE_DIR:
+#   <session>.folded  collapsed stacks (flamegraph.pl / speedscope compatible)
+#   <session>.prof    merged cProfile stats (pstats / snakeviz)
+#   <session>.txt     top functions by cumulative time
+#
+# While idle, a wrapped endpoint pays a single attribute check.
+# -------------------------------------------------
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    """Root-first, ';'-joined stack for one frame (collapsed-stack format)."""
+    parts = []
+    while frame is not None:
+        parts.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class Profiler:
+    """
+    One profiling session at a time, bounded by a request count and/or a time window.
+
+    - Wall-clock stacks are sampled from a background thread, but only for
+      threads currently running a wrapped request.
+    - One wrapped request at a time also runs under a cProfile.Profile (Python
+      3.12+ allows a single active profiler per process); concurrent requests
+      are sampled only. Results are merged into one pstats.Stats.
+    """
+
+    def __init__(self, out_dir: str = PROFILE_DIR, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.out_dir = out_dir
+        self.interval = max(interval_ms, 0.5) / 1000.0
+        self.active = False
+
+        self._lock = threading.Lock()
+        self._remaining: Optional[int] = None   # None -> unbounded (time window only)
+        self._deadline: Optional[float] = None  # None -> unbounded (count only)
+        self._inflight: dict[int, str] = {}     # thread ident -> endpoint name
+        self._cprofiling: Optional[int] = None  # thread ident of the request under cProfile
+        self._stacks: Counter = Counter()
+        self._stats: Optional[pstats.Stats] = None
+        self._session = ""
+        self._seq = 0
+        self._requests = 0
+        self._samples = 0
+        self._last: Optional[dict] = None
+
+    # ---------------------------
+    # Session control
+    # ---------------------------
+
+    def start(self, requests: int = 0, seconds: float = 0.0) -> dict:
+        if requests <= 0 and seconds <= 0:
+            raise ValueError("Set requests > 0 and/or seconds > 0.")
+        with self._lock:
+            if self.active:
+                raise RuntimeError("A profiling session is already running in this worker.")
+            self._remaining = int(requests) if requests > 0 else None
+            self._deadline = time.monotonic() + float(seconds) if seconds > 0 else None
+            self._stacks = Counter()
+            self._stats = None
+            self._requests = 0
+            self._samples = 0
+            self._seq += 1
+            self._session = time.strftime("%Y%m%d-%H%M%S") + f"-pid{os.getpid()}-{self._seq}"
+            self.active = True
+
+        threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True).start()
+        return self.status()
+
+    def stop(self) -> dict:
+        """End the current session early and flush whatever was collected."""
+        self._finish()
+        return self.status()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "pid": os.getpid(),
+                "session": self._session or None,
+                "requests_profiled": self._requests,
+                "requests_remaining": self._remaining,
+                "seconds_remaining": (
+                    max(self._deadline - time.monotonic(), 0.0) if self.active and self._deadline else None
+                ),
+                "samples": self._samples,
+                "last_output": self._last,
+            }
+
+    # ---------------------------
+    # Request hooks
+    # ---------------------------
+
+    def _claim(self, name: str) -> Optional[bool]:
+        """None: not profiled. Otherwise sampled; True if this request also gets the cProfile."""
+        with self._lock:
+            if not self.active:
+                return None
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                return None
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    return None
+                self._remaining -= 1
+            me = threading.get_ident()
+            self._inflight[me] = name
+            if self._cprofiling is None:
+                self._cprofiling = me
+                return True
+            return False
+
+    def _release(self, prof: Optional[cProfile.Profile]):
+        if prof is not None:
+            prof.create_stats()
+        with self._lock:
+            me = threading.get_ident()
+            self._inflight.pop(me, None)
+            if self._cprofiling == me:
+                self._cprofiling = None
+            if not self.active:
+                # session was stopped early; its output is already on disk
+                return
+            self._requests += 1
+            if prof is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(prof)
+                else:
+                    self._stats.add(prof)
+            done = self._remaining is not None and self._remaining <= 0 and not self._inflight
+        if done:
+            self._finish()
+
+    def wrap(self, fn):
+        """Decorator for sync endpoints; keeps the signature FastAPI inspects."""
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.active:
+                return fn(*args, **kwargs)
+            claim = self._claim(name)
+            if claim is None:
+                return fn(*args, **kwargs)
+            prof = cProfile.Profile() if claim else None
+            try:
+                if prof is not None:
+                    try:
+                        prof.enable()
+                    except ValueError:
+                        # another profiling tool holds the hook (debugger, coverage): sample only
+                        prof = None
+                return fn(*args, **kwargs)
+            finally:
+                if prof is not None:
+                    prof.disable()
+                self._release(prof)
+
+        return wrapper
+
+    # ---------------------------
+    # Sampling & output
+    # ---------------------------
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while self.active:
+            frames = sys._current_frames()
+            with self._lock:
+                targets = [(tid, name) for tid, name in self._inflight.items() if tid != me]
+            sampled = [
+                f"{name};{_collapse(frames[tid])}" for tid, name in targets if tid in frames
+            ]
+            del frames
+            with self._lock:
+                if not self.active:
+                    return
+                self._stacks.update(sampled)
+                self._samples += len(sampled)
+
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                with self._lock:
+                    idle = not self._inflight
+                if idle:
+                    self._finish()
+                    return
+            time.sleep(self.interval)
+
+    def _finish(self):
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            stacks, stats, session = self._stacks, self._stats, self._session
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, session)
+        out = {"folded": base + ".folded"}
+
+        with open(out["folded"], "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        if stats is not None:
+            out["prof"] = base + ".prof"
+            out["txt"] = base + ".txt"
+            stats.dump_stats(out["prof"])
+            buf = io.StringIO()
+            stats.stream = buf
+            stats.sort_stats("cumulative").print_stats(50)
+            with open(out["txt"], "w", encoding="utf-8") as f:
+                f.write(buf.getvalue())
+
+        with self._lock:
+            self._last = out
+
+
+PROFILER = Profiler()
+profiled = PROFILER.wrap
+
+
+def start_from_env():
+    """Kick off a boot-time session when PROFILE_REQUESTS / PROFILE_SECONDS are set."""
+    requests = int(os.getenv("PROFILE_REQUESTS", "0") or 0)
+    seconds = float(os.getenv("PROFILE_SECONDS", "0") or 0)
+    if requests > 0 or seconds > 0:
+        PROFILER.start(requests=requests, seconds=seconds)
@@ -0,0 +1,193 @@
+import heapq
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from threading import Condition
+from typing import Any, Callable, Optional
+
+# -------------------------------------------------
+# Priority-aware token bucket for every Gemini call (embeddings + generation).
+#
+# Callers queue by priority: interactive (/query) first, then background
+# ingestion, then bulk re-embeds. Background/bulk work also leaves
+# GEMINI_INTERACTIVE_RESERVE tokens in the bucket, so a reindex can't drain
+# it ahead of a user. A 429 halves the rate and pauses the bucket with an
+# exponential backoff; successes add the rate back gradually (AIMD).
+#
+# GEMINI_RPM is the budget for the whole deployment; each worker process
+# takes GEMINI_RPM / GEMINI_WORKERS (default: WEB_CONCURRENCY or 1).
+#
+# Priority is ambient (a ContextVar), so call sites deep in embed.py don't
+# need an extra argument:
+#
+#   with priority(BULK):
+#       embed_batched(client, texts, "RETRIEVAL_DOCUMENT")
+# -------------------------------------------------
+
+INTERACTIVE, BACKGROUND, BULK = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BULK: "bulk"}
+
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "600"))
+GEMINI_WORKERS = max(int(os.getenv("GEMINI_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"), 1)
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "10"))
+GEMINI_INTERACTIVE_RESERVE = float(os.getenv("GEMINI_INTERACTIVE_RESERVE", "2"))
+GEMINI_429_RETRIES = int(os.getenv("GEMINI_429_RETRIES", "4"))
+
+_MAX_BACKOFF_S = 30.0
+
+_priority: ContextVar[int] = ContextVar("gemini_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed Gemini calls at `level` (INTERACTIVE, BACKGROUND or BULK)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if code == 429:
+        return True
+    text = str(exc)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+class RateLimiter:
+    def __init__(self, rate_per_s: float, burst: float, reserve: float = GEMINI_INTERACTIVE_RESERVE):
+        self.max_rate = max(rate_per_s, 1e-3)
+        self.min_rate = self.max_rate * 0.05
+        self.rate = self.max_rate
+        self.burst = max(burst, 1.0)
+        # never reserve so much that background work can't run at all
+        self.reserve = max(min(reserve, self.burst - 1.0), 0.0)
+
+        self._cond = Condition()
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._strikes = 0  # consecutive 429s
+        self._waiting: list[tuple[int, int]] = []  # heap of (priority, seq)
+        self._seq = count()
+
+        self.throttled = 0
+        self._granted = {p: 0 for p in PRIORITY_NAMES}
+        self._wait_total = {p: 0.0 for p in PRIORITY_NAMES}
+        self._wait_max = {p: 0.0 for p in PRIORITY_NAMES}
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, level: Optional[int] = None, cost: float = 1.0) -> float:
+        """Block until this call may go out; returns seconds waited."""
+        level = current_priority() if level is None else level
+        ticket = (level, next(self._seq))
+        need = cost + (0.0 if level == INTERACTIVE else self.reserve)
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._cond.notify_all()  # a higher-priority arrival takes over the head
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self._paused_until:
+                        delay = self._paused_until - now
+                    elif self._waiting[0] != ticket:
+                        delay = None  # woken when the head is granted
+                    elif self._tokens >= need:
+                        break
+                    else:
+                        delay = (need - self._tokens) / self.rate
+                    self._cond.wait(delay)
+                heapq.heappop(self._waiting)
+                self._tokens -= cost
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                raise
+            finally:
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self._granted[level] += 1
+            self._wait_total[level] += waited
+            self._wait_max[level] = max(self._wait_max[level], waited)
+        return waited
+
+    def on_throttled(self):
+        """Multiplicative decrease + exponential pause after a 429."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            self._strikes += 1
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self._tokens = 0.0
+            backoff = min(_MAX_BACKOFF_S, 0.5 * 2 ** (self._strikes - 1))
+            self._paused_until = max(self._paused_until, now + backoff)
+            self._cond.notify_all()
+
+    def on_success(self):
+        """Additive increase back towards the configured rate."""
+        with self._cond:
+            self._strikes = 0
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def call(self, fn: Callable[[], Any], level: Optional[int] = None, cost: float = 1.0) -> Any:
+        """fn() once admitted by the bucket; 429s are retried through the bucket."""
+        level = current_priority() if level is None else level
+        for attempt in range(max(GEMINI_429_RETRIES, 0) + 1):
+            self.acquire(level, cost)
+            try:
+                result = fn()
+            except Exception as e:
+                if is_rate_limited(e):
+                    self.on_throttled()
+                    if attempt < GEMINI_429_RETRIES:
+                        continue
+                raise
+            self.on_success()
+            return result
+
+    def metrics(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for level, _ in self._waiting:
+                depth[PRIORITY_NAMES[level]] += 1
+            return {
+                "rate_per_s": self.rate,
+                "max_rate_per_s": self.max_rate,
+                "tokens": self._tokens,
+                "burst": self.burst,
+                "paused_for_s": max(self._paused_until - now, 0.0),
+                "throttled": self.throttled,
+                "queue_depth": depth,
+                "granted": {PRIORITY_NAMES[p]: n for p, n in self._granted.items()},
+                "wait_s": {
+                    PRIORITY_NAMES[p]: {
+                        "avg": self._wait_total[p] / self._granted[p] if self._granted[p] else 0.0,
+                        "max": self._wait_max[p],
+                    }
+                    for p in PRIORITY_NAMES
+                },
+            }
+
+
+# one bucket per worker process, shared by embeddings and generation
+GEMINI = RateLimiter(GEMINI_RPM / 60.0 / GEMINI_WORKERS, GEMINI_BURST)
@@ -0,0 +1,647 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from threading import Lock, Thread
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from embed import (
+    EMBED_BATCH, append_cache, cache_lock, embed_batched, file_lock, fully_embed, normalize, write_cache,
+)
+from corpus import (
+    ACCEL_SPEC, REQ_SPEC, CorpusSpec, append_csv_rows, load_corpus, norm_text, tokenize,
+)
+from partitions import PartitionIndex
+from ratelimit import BULK, priority
+from reverse import ReverseIndex
+
+# -------------------------------------------------
+# Collection registry
+#
+# A collection is one accelerator catalogue + its user-request log (what
+# api.py used to hold as the ACCEL_* / REQ_* globals). "default" maps to the
+# original data/ files; more portfolios/regions come from COLLECTIONS_FILE:
+#
+#   {
+#     "emea": {"accelerators_csv": "data/emea/accelerators.csv",
+#              "requests_csv":     "data/emea/u_hack.csv",
+#              "accel_tokens":     "data/emea/accel_tokens.txt",   # optional
+#              "req_tokens":       "data/emea/hack_tokens.txt"}    # optional
+#   }
+#
+# Each collection keeps its own caches under data/collections/<name>/
+# (its own embedding namespace), loads on first use, and is evicted
+# least-recently-used when the loaded set exceeds COLLECTION_RAM_MB.
+# Collections in COLLECTIONS_PINNED are never evicted.
+#
+# Index artifacts (see build_index.py): the vector/text caches of both
+# corpora plus index_meta.json (gap counters and a digest of the texts they
+# were computed from). Loading a collection only reads these; if they're
+# missing or stale it embeds under INDEX_LOCK_FILE, so one process builds
+# while the others wait and then load the result.
+# -------------------------------------------------
+
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_FILE = os.getenv("COLLECTIONS_FILE", "data/collections.json")
+COLLECTIONS_DIR = os.getenv("COLLECTIONS_DIR", "data/collections")
+COLLECTION_RAM_MB = float(os.getenv("COLLECTION_RAM_MB", "0"))  # 0 -> no budget
+COLLECTIONS_PINNED = tuple(
+    c.strip() for c in os.getenv("COLLECTIONS_PINNED", DEFAULT_COLLECTION).split(",") if c.strip()
+)
+INDEX_LOCK_FILE = os.getenv("INDEX_LOCK_FILE", "data/.index_build.lock")
+
+
+@dataclass(frozen=True)
+class CollectionSpec:
+    name: str
+    accel: CorpusSpec
+    reqs: CorpusSpec
+    meta_path: str
+
+
+def default_collection_spec() -> CollectionSpec:
+    return CollectionSpec(DEFAULT_COLLECTION, ACCEL_SPEC, REQ_SPEC, "data/index_meta.json")
+
+
+def collection_spec(name: str, cfg: dict) -> CollectionSpec:
+    """Spec for a configured collection; caches live in its own namespace directory."""
+    base = os.path.join(COLLECTIONS_DIR, name)
+    accel = replace(
+        ACCEL_SPEC,
+        name=f"{name}/accelerators",
+        csv_path=cfg["accelerators_csv"],
+        vec_path=os.path.join(base, "accel_vectors.npy"),
+        txt_path=os.path.join(base, "accel_text.txt"),
+        tokens_path=cfg.get("accel_tokens", ACCEL_SPEC.tokens_path),
+    )
+    reqs = replace(
+        REQ_SPEC,
+        name=f"{name}/requests",
+        csv_path=cfg["requests_csv"],
+        vec_path=os.path.join(base, "user_vectors.npy"),
+        txt_path=os.path.join(base, "user_text.txt"),
+        tokens_path=cfg.get("req_tokens", REQ_SPEC.tokens_path),
+    )
+    return CollectionSpec(name, accel, reqs, os.path.join(base, "index_meta.json"))
+
+
+def load_collection_specs(path: str = COLLECTIONS_FILE) -> list[CollectionSpec]:
+    specs = [default_collection_spec()]
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        for name, entry in cfg.items():
+            if name != DEFAULT_COLLECTION:
+                specs.append(collection_spec(name, entry))
+    return specs
+
+
+@contextmanager
+def build_lock(path: str = INDEX_LOCK_FILE):
+    """Serializes index builds across processes on this host (no-op without fcntl)."""
+    with file_lock(path):
+        yield
+
+
+def _texts_digest(accel_texts: list[str], reqs_texts: list[str]) -> str:
+    h = hashlib.sha1()
+    for t in accel_texts:
+        h.update(t.encode("utf-8", "replace") + b"\n")
+    h.update(b"\0")
+    for t in reqs_texts:
+        h.update(t.encode("utf-8", "replace") + b"\n")
+    return h.hexdigest()
+
+
+def _token_stamps(spec: CollectionSpec) -> list:
+    return [
+        os.path.getmtime(p) if p and os.path.exists(p) else None
+        for p in (spec.accel.tokens_path, spec.reqs.tokens_path)
+    ]
+
+
+def read_index_meta(spec: CollectionSpec) -> Optional[dict]:
+    try:
+        with open(spec.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def request_row(item) -> dict:
+    """
+    Normalize one incoming request (plain text, {"text": ...} or a u_hack-style
+    row with any of REQ_SPEC.cols) into a CSV row; free text lands in `description`.
+    """
+    if isinstance(item, str):
+        item = {"text": item}
+    row = {c: str(item.get(c) or "").strip() for c in REQ_SPEC.cols}
+    text = str(item.get("text") or "").strip()
+    if text and not row["description"]:
+        row["description"] = text
+    return row
+
+
+# ---------------------------
+# Snapshot (read side)
+# ---------------------------
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    One published version of a collection's searchable state. Readers take
+    `col.snap` once and use only that; writers never mutate a published
+    snapshot's DataFrames, lists, arrays, token sets or counters, they
+    publish a new one. The partition and reverse indexes are append-only
+    between rebuilds and may be shared by consecutive versions, so readers
+    clip their row ids to their own snapshot's request count.
+    """
+    version: int
+    accel_df: pd.DataFrame
+    accel_texts: list[str]
+    accel_embed: np.ndarray
+    accel_tokens: frozenset[str]
+    reqs_df: pd.DataFrame
+    reqs_texts: list[str]
+    req_embed: np.ndarray
+    req_tokens: frozenset[str]
+    req_parts: PartitionIndex
+    req_by_accel: ReverseIndex
+    gap_freq: Counter  # request tokens that no accelerator covers
+
+    def top_gap_topics(self, k: int) -> list[str]:
+        return [w for w, _ in self.gap_freq.most_common(k)]
+
+
+def _count_gaps(gap_freq: Counter, toks: set[str], req_tokens, accel_tokens):
+    for t in toks:
+        if t in req_tokens and t not in accel_tokens:
+            gap_freq[t] += 1
+
+
+def _build_indexes(reqs_df, accel_embed, req_embed) -> tuple[PartitionIndex, ReverseIndex]:
+    parts = PartitionIndex()
+    parts.build(reqs_df, req_embed)
+    rev = ReverseIndex()
+    rev.build(accel_embed, req_embed)
+    return parts, rev
+
+
+# ---------------------------
+# Collection (write side)
+# ---------------------------
+
+class Collection:
+    """
+    One collection: the current Snapshot plus the write path for requests.
+    Writers embed and build the next version off to the side, then swap
+    `snap` under `lock` (a single reference assignment); readers never block.
+    """
+
+    def __init__(self, spec: CollectionSpec, client, lock: Lock, rebuild: bool = True):
+        self.spec = spec
+        self.client = client
+        self.lock = lock  # owned by the registry, so it outlives evictions
+        self._reindex_lock = Lock()  # one re-embed at a time; doesn't block ingest
+
+        try:
+            # may still embed rows other workers ingested but never cached (CACHE_TOPUP_MAX)
+            with priority(BULK):
+                accel = load_corpus(spec.accel, client, rebuild=False)
+                reqs = load_corpus(spec.reqs, client, rebuild=False)
+        except RuntimeError:
+            if not rebuild:
+                raise
+            # one process embeds; the others block here, then find fresh caches
+            with build_lock(), priority(BULK):
+                accel = load_corpus(spec.accel, client)
+                reqs = load_corpus(spec.reqs, client)
+        parts, rev = _build_indexes(reqs.df, accel.embed, reqs.embed)
+
+        # gap counters from index_meta.json when it describes these exact texts
+        digest = _texts_digest(accel.texts, reqs.texts)
+        meta = read_index_meta(spec)
+        meta_ok = bool(meta) and meta.get("digest") == digest and meta.get("token_stamps") == _token_stamps(spec)
+        if meta_ok:
+            gap_freq = Counter(meta.get("gap_freq") or {})
+        else:
+            gap_freq = Counter()
+            for text in reqs.texts:
+                _count_gaps(gap_freq, tokenize(text), reqs.tokens, accel.tokens)
+
+        self.snap = Snapshot(
+            version=1,
+            accel_df=accel.df, accel_texts=accel.texts, accel_embed=accel.embed,
+            accel_tokens=frozenset(accel.tokens),
+            reqs_df=reqs.df, reqs_texts=reqs.texts, req_embed=reqs.embed,
+            req_tokens=frozenset(reqs.tokens),
+            req_parts=parts, req_by_accel=rev, gap_freq=gap_freq,
+        )
+
+        # normalized request texts for O(1) dedup (writer side, updated under lock)
+        self.req_norms = {norm_text(t) for t in reqs.texts}
+
+        self._accel_by_name = {}
+        title_col = spec.accel.title_col
+        if title_col and title_col in accel.df.columns:
+            for i, name in enumerate(accel.df[title_col]):
+                self._accel_by_name.setdefault(norm_text(name), i)
+
+        self._df_bytes = int(accel.df.memory_usage(deep=True).sum() + reqs.df.memory_usage(deep=True).sum())
+
+        if not meta_ok:
+            self.save_index_meta()
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def save_index_meta(self):
+        """Write index_meta.json for the current snapshot (write-then-rename)."""
+        snap = self.snap
+        meta = {
+            "collection": self.name,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "accelerator_count": len(snap.accel_texts),
+            "user_request_count": len(snap.reqs_texts),
+            "embedding_dim": int(snap.req_embed.shape[1]) if snap.req_embed is not None else None,
+            "digest": _texts_digest(snap.accel_texts, snap.reqs_texts),
+            "token_stamps": _token_stamps(self.spec),
+            "gap_freq": dict(snap.gap_freq),
+        }
+        os.makedirs(os.path.dirname(self.spec.meta_path) or ".", exist_ok=True)
+        tmp = self.spec.meta_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, self.spec.meta_path)
+
+    def _publish(self, **changes):
+        """Swap in the next version. Caller holds self.lock."""
+        self.snap = replace(self.snap, version=self.snap.version + 1, **changes)
+
+    def nbytes(self) -> int:
+        """Approximate resident size (vectors, partition copies, DataFrames)."""
+        snap = self.snap
+        vecs = sum(int(getattr(m, "nbytes", 0)) for m in (snap.accel_embed, snap.req_embed))
+        return vecs + snap.req_parts.nbytes() + snap.req_by_accel.nbytes() + self._df_bytes
+
+    def accel_index(self, name: str) -> Optional[int]:
+        """Row of the accelerator with this (case/whitespace-insensitive) name."""
+        return self._accel_by_name.get(norm_text(name))
+
+    # ---------------------------
+    # Embedding maintenance
+    # ---------------------------
+
+    def ensure_dim(self, dim: int):
+        """Re-embed a corpus whose cached vectors don't match the query dimension."""
+        if self.snap.accel_embed.shape[1] != dim:
+            with self._reindex_lock, priority(BULK):
+                base = self.snap
+                if base.accel_embed.shape[1] != dim:
+                    vec = normalize(embed_batched(self.client, base.accel_texts, "RETRIEVAL_DOCUMENT", True))
+                    with self.lock:
+                        write_cache(self.spec.accel.vec_path, self.spec.accel.txt_path, vec, base.accel_texts)
+                        snap = self.snap
+                        rev = ReverseIndex()
+                        rev.build(vec, snap.req_embed)
+                        self._publish(accel_embed=vec, req_by_accel=rev)
+        if self.snap.req_embed.shape[1] != dim:
+            self.reindex_requests()
+
+    def reindex_requests(self) -> int:
+        """
+        Re-embed every request without holding the write lock; rows ingested
+        meanwhile are carried over when the new version is published.
+        """
+        with self._reindex_lock, priority(BULK):
+            base = self.snap
+            n0 = len(base.reqs_texts)
+            vec = normalize(embed_batched(self.client, base.reqs_texts, "RETRIEVAL_DOCUMENT", True))
+            parts, rev = _build_indexes(base.reqs_df, base.accel_embed, vec)
+
+            with self.lock:
+                snap = self.snap
+                if len(snap.reqs_texts) > n0:
+                    tail = snap.req_embed[n0:]
+                    if tail.shape[1] != vec.shape[1]:
+                        tail = normalize(embed_batched(self.client, snap.reqs_texts[n0:], "RETRIEVAL_DOCUMENT", True))
+                    vec = np.vstack([vec, tail])
+                    parts.add(snap.reqs_df.iloc[n0:], n0, tail)
+                    rev.add(snap.accel_embed, n0, tail)
+                if snap.accel_embed is not base.accel_embed:
+                    rev = ReverseIndex()
+                    rev.build(snap.accel_embed, vec)
+                write_cache(self.spec.reqs.vec_path, self.spec.reqs.txt_path, vec, snap.reqs_texts)
+                self._publish(req_embed=vec, req_parts=parts, req_by_accel=rev)
+                return len(snap.reqs_texts)
+
+    # ---------------------------
+    # Persistence / Incremental embedding
+    # ---------------------------
+
+    def persist_requests(self, items: Iterable) -> dict:
+        """
+        Persist many user requests in one pass and update embeddings/caches.
+
+        Steps:
+        - Build each row's corpus text; skip empties and duplicates (vs corpus and batch)
+        - Embed new texts in EMBED_BATCH chunks, outside the collection lock; rows of a
+          failed chunk are reported as errors, the other chunks are still stored
+        - Under the lock: re-check duplicates, build the next snapshot (reqs_texts/reqs_df,
+          one vstack into req_embed; re-embed all on dim mismatch) and publish it
+        - One cache append (npy + txt), one fsync'd CSV append, then indexes, tokens, gap_freq;
+          a failed flush marks the rows as errors and changes nothing in memory
+
+        Returns counts plus a per-row status list.
+        """
+        cols = self.spec.reqs.cols
+        statuses: list[dict] = []
+        pending_rows: list[dict] = []
+        pending_texts: list[str] = []
+        pending_pos: list[int] = []
+        seen: set[str] = set()
+
+        # ---- 1) Stream rows: build text, dedup ----
+        for pos, item in enumerate(items):
+            try:
+                row = request_row(item)
+            except Exception as e:
+                statuses.append({"row": pos, "status": "error", "reason": f"bad_row: {e}"})
+                continue
+            text = " | ".join(row[c] for c in cols if row[c])
+            norm = norm_text(text)
+            if not norm:
+                statuses.append({"row": pos, "status": "skipped", "reason": "empty"})
+            elif norm in seen or norm in self.req_norms:
+                statuses.append({"row": pos, "status": "skipped", "reason": "duplicate"})
+            else:
+                seen.add(norm)
+                statuses.append({"row": pos, "status": "ok"})
+                pending_rows.append(row)
+                pending_texts.append(text)
+                pending_pos.append(pos)
+
+        # ---- 2) Embed new texts in EMBED_BATCH chunks (no lock held); a failed chunk fails only its rows ----
+        embedded: list[tuple[list[int], np.ndarray]] = []
+        size = max(EMBED_BATCH, 1)
+        for i in range(0, len(pending_texts), size):
+            idx = list(range(i, min(i + size, len(pending_texts))))
+            try:
+                vecs = normalize(fully_embed(self.client, pending_texts[i:i + size], "RETRIEVAL_DOCUMENT", True))
+            except Exception as e:
+                for j in idx:
+                    statuses[pending_pos[j]] = {"row": pending_pos[j], "status": "error", "reason": f"embed_failed: {e}"}
+                continue
+            embedded.append((idx, vecs))
+
+        if len({v.shape[1] for _, v in embedded}) > 1:
+            # backend fell back to local part-way: re-embed the survivors so all rows share one model
+            idx = [j for ids, _ in embedded for j in ids]
+            try:
+                embedded = [(idx, normalize(embed_batched(
+                    self.client, [pending_texts[j] for j in idx], "RETRIEVAL_DOCUMENT", True
+                )))]
+            except Exception as e:
+                for j in idx:
+                    statuses[pending_pos[j]] = {"row": pending_pos[j], "status": "error", "reason": f"embed_failed: {e}"}
+                embedded = []
+
+        ok = [j for ids, _ in embedded for j in ids]
+        new_vecs = np.vstack([v for _, v in embedded]) if embedded else None
+        pending_rows = [pending_rows[j] for j in ok]
+        pending_texts = [pending_texts[j] for j in ok]
+        pending_pos = [pending_pos[j] for j in ok]
+
+        if pending_texts:
+            with self.lock:
+                # ---- 3) Re-check duplicates inserted while we were embedding ----
+                keep = []
+                for j, (pos, text) in enumerate(zip(pending_pos, pending_texts)):
+                    if norm_text(text) in self.req_norms:
+                        statuses[pos] = {"row": pos, "status": "skipped", "reason": "duplicate"}
+                    else:
+                        keep.append(j)
+                rows = [pending_rows[j] for j in keep]
+                texts = [pending_texts[j] for j in keep]
+                vecs = new_vecs[keep]
+
+                if rows:
+                    try:
+                        self._append_requests(rows, texts, vecs)
+                    except Exception as e:
+                        # nothing was indexed or published; the rows can be retried
+                        for j in keep:
+                            pos = pending_pos[j]
+                            statuses[pos] = {"row": pos, "status": "error", "reason": f"persist_failed: {e}"}
+                    else:
+                        self.req_norms.update(norm_text(t) for t in texts)
+
+        counts = Counter(st["status"] for st in statuses)
+        return {
+            "received": len(statuses),
+            "inserted": counts.get("ok", 0),
+            "skipped": counts.get("skipped", 0),
+            "errors": counts.get("error", 0),
+            "rows": statuses,
+        }
+
+    def _append_requests(self, rows: list[dict], texts: list[str], vecs: np.ndarray):
+        """Caller holds self.lock. Builds the next snapshot from the current one and publishes it."""
+        snap = self.snap
+
+        # ---- 4) Append in memory and DataFrame (keep schema); new objects, old snapshot untouched ----
+        start = len(snap.reqs_texts)
+        new_df = pd.DataFrame(rows)
+        reqs_texts = snap.reqs_texts + texts
+        reqs_df = pd.concat([snap.reqs_df, new_df], ignore_index=True)
+
+        # ---- 5) Update req_embed (one vstack) ----
+        rebuilt = snap.req_embed is None or vecs.shape[1] != snap.req_embed.shape[1]
+        if snap.req_embed is None:
+            req_embed = vecs
+        elif rebuilt:
+            # Mismatch (e.g., model changed) -> re-embed all
+            req_embed = normalize(embed_batched(self.client, reqs_texts, "RETRIEVAL_DOCUMENT", True))
+        else:
+            req_embed = np.vstack([snap.req_embed, vecs])
+
+        # ---- 6) Save cache + CSV once (before touching any shared index, so a failed flush leaves no trace) ----
+        # Other workers append to the same files: add our rows to the cache as it is on disk
+        # (never rewrite it from this snapshot), and append the CSV under the same lock so both
+        # keep one row order. A cache row whose CSV append failed is skipped on retry and on load.
+        spec = self.spec.reqs
+        if rebuilt:
+            write_cache(spec.vec_path, spec.txt_path, req_embed, reqs_texts)
+        with cache_lock(spec.vec_path):
+            if not rebuilt:
+                append_cache(spec.vec_path, spec.txt_path, vecs, texts)
+            append_csv_rows(spec.csv_path, rows, spec.cols)
+
+        parts, rev = snap.req_parts, snap.req_by_accel
+        if rebuilt:
+            parts, rev = _build_indexes(reqs_df, snap.accel_embed, req_embed)
+        else:
+            # append-only: readers of the current version clip ids >= their row count
+            parts.add(new_df, start, vecs)
+            rev.add(snap.accel_embed, start, vecs)
+
+        # ---- 7) Update tokens & gap counts ----
+        req_tokens = set(snap.req_tokens)
+        gap_freq = Counter(snap.gap_freq)
+        for text in texts:
+            toks = tokenize(text)
+            req_tokens.update(toks)
+            _count_gaps(gap_freq, toks, req_tokens, snap.accel_tokens)
+
+        # ---- 8) Publish ----
+        self._publish(
+            reqs_df=reqs_df, reqs_texts=reqs_texts, req_embed=req_embed,
+            req_tokens=frozenset(req_tokens), req_parts=parts, req_by_accel=rev, gap_freq=gap_freq,
+        )
+
+    def persist_request(self, text: str, meta: Optional[dict] = None) -> dict:
+        """Persist a single user request; see persist_requests."""
+        t_clean = (text or "").strip()
+        if not t_clean:
+            return {"status": "skipped", "reason": "empty"}
+        res = self.persist_requests([t_clean])["rows"][0]
+        return {k: v for k, v in res.items() if k != "row"}
+
+
+# ---------------------------
+# Registry
+# ---------------------------
+
+class CollectionRegistry:
+    def __init__(self, client, specs: Iterable[CollectionSpec],
+                 ram_budget_mb: float = COLLECTION_RAM_MB, pinned: Iterable[str] = COLLECTIONS_PINNED,
+                 rebuild: bool = True):
+        self.client = client
+        self.specs = {s.name: s for s in specs}
+        self.rebuild = rebuild  # False: serve prebuilt artifacts only
+        self.budget = int(ram_budget_mb * 1024 * 1024)
+        self.pinned = set(pinned)
+
+        self._lock = Lock()
+        self._loaded: "OrderedDict[str, Collection]" = OrderedDict()  # LRU order, oldest first
+        self._in_use: Counter = Counter()
+        self._load_locks = {name: Lock() for name in self.specs}
+        self._write_locks = {name: Lock() for name in self.specs}
+        self._loading: set[str] = set()
+        self._load_errors: dict[str, str] = {}  # last failed load per name, until a load succeeds
+        self.evictions = 0
+
+    def names(self) -> list[str]:
+        return list(self.specs)
+
+    def _load(self, name: str) -> Collection:
+        # one loader per name; concurrent first queries wait for it
+        with self._load_locks[name]:
+            with self._lock:
+                col = self._loaded.get(name)
+            if col is None:
+                with self._lock:
+                    self._loading.add(name)
+                try:
+                    # don't read the files while an evicted instance is still writing them
+                    with self._write_locks[name]:
+                        col = Collection(self.specs[name], self.client, self._write_locks[name], self.rebuild)
+                finally:
+                    with self._lock:
+                        self._loading.discard(name)
+                with self._lock:
+                    self._loaded[name] = col
+            return col
+
+    def is_loaded(self, name: str) -> bool:
+        with self._lock:
+            return name in self._loaded
+
+    def load_async(self, name: str) -> Optional[str]:
+        """
+        Start loading `name` on a background thread unless it is loaded or already
+        loading, so a request never embeds a whole corpus inline. Returns the error
+        of the last failed attempt, if any; every call after a failure retries.
+        """
+        if name not in self.specs:
+            raise KeyError(name)
+        with self._lock:
+            error = self._load_errors.get(name)
+            if name in self._loaded or name in self._loading:
+                return error
+            self._loading.add(name)
+        Thread(target=self._load_in_background, args=(name,), name=f"load-{name}", daemon=True).start()
+        return error
+
+    def _load_in_background(self, name: str):
+        try:
+            self._load(name)
+            self._evict_over_budget(keep=name)
+        except Exception as e:
+            with self._lock:
+                self._load_errors[name] = str(e)
+        else:
+            with self._lock:
+                self._load_errors.pop(name, None)
+        finally:
+            with self._lock:
+                self._loading.discard(name)
+
+    @contextmanager
+    def use(self, name: str = DEFAULT_COLLECTION):
+        """Borrow a loaded collection (loading it on first use); in-use collections are never evicted."""
+        if name not in self.specs:
+            raise KeyError(name)
+        with self._lock:
+            col = self._loaded.get(name)
+            if col is not None:
+                self._loaded.move_to_end(name)
+            self._in_use[name] += 1
+        try:
+            if col is None:
+                col = self._load(name)
+                self._evict_over_budget(keep=name)
+            yield col
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def _evict_over_budget(self, keep: str):
+        if self.budget <= 0:
+            return
+        with self._lock:
+            total = sum(c.nbytes() for c in self._loaded.values())
+            for name in list(self._loaded):
+                if total <= self.budget:
+                    break
+                if name == keep or name in self.pinned or self._in_use[name] > 0:
+                    continue
+                total -= self._loaded.pop(name).nbytes()
+                self.evictions += 1
+
+    def loading(self) -> list[str]:
+        """Collections being loaded right now (cheap; no byte totals)."""
+        with self._lock:
+            return sorted(self._loading)
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = {name: (c.nbytes(), c.snap.version) for name, c in self._loaded.items()}
+            loading = sorted(self._loading)
+        return {
+            "collections": self.names(),
+            "loading": loading,
+            "loaded": {
+                n: {"bytes": b, "version": v, "pinned": n in self.pinned} for n, (b, v) in loaded.items()
+            },
+            "loaded_bytes": sum(b for b, _ in loaded.values()),
+            "budget_bytes": self.budget or None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,74 @@
+import os
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from corpus import top_k_rows
+
+# -------------------------------------------------
+# Reverse index: accelerator -> its top-N closest user requests.
+#
+# For every accelerator we keep a fixed-width (N) row of request ids and
+# scores, best first. Ingested requests are scored against all accelerators
+# once (n_new x n_accel) and merged into those rows, so "which requests map
+# to accelerator X?" is a lookup instead of a full req x accel matmul.
+# -------------------------------------------------
+
+REVERSE_TOP_N = int(os.getenv("REVERSE_TOP_N", "50"))
+REVERSE_BUILD_BLOCK = 4096  # request rows scored per step when (re)building
+
+
+class ReverseIndex:
+    def __init__(self, top_n: int = REVERSE_TOP_N):
+        self.top_n = max(int(top_n), 1)
+        self._lock = Lock()
+        # (ids, scores), each (n_accel, top_n); published together so readers never see a torn merge
+        self.view = (np.empty((0, self.top_n), dtype=np.int64), np.empty((0, self.top_n), dtype=np.float32))
+
+    def build(self, accel_embed: np.ndarray, req_embed: np.ndarray):
+        """Rebuild from scratch (startup, reindex, dim change)."""
+        n_accel = accel_embed.shape[0]
+        ids = np.full((n_accel, self.top_n), -1, dtype=np.int64)
+        scores = np.full((n_accel, self.top_n), -np.inf, dtype=np.float32)
+        if req_embed is None or req_embed.shape[1] != accel_embed.shape[1]:
+            # dims disagree until ensure_dim re-embeds one side; that rebuilds us again
+            req_embed = np.empty((0, accel_embed.shape[1]), dtype=np.float32)
+        for start in range(0, req_embed.shape[0], REVERSE_BUILD_BLOCK):
+            block = req_embed[start:start + REVERSE_BUILD_BLOCK]
+            ids, scores = self._merge(ids, scores, accel_embed, block, start)
+        with self._lock:
+            self.view = (ids, scores)
+
+    def add(self, accel_embed: np.ndarray, start: int, vecs: np.ndarray):
+        """Merge request rows start..start+len(vecs)-1 into every accelerator's top-N."""
+        if len(vecs) == 0:
+            return
+        with self._lock:
+            ids, scores = self.view
+            if ids.shape[0] != accel_embed.shape[0] or vecs.shape[1] != accel_embed.shape[1]:
+                return
+            self.view = self._merge(ids, scores, accel_embed, vecs, start)
+
+    def _merge(self, ids, scores, accel_embed, vecs, start):
+        sims = np.asarray(accel_embed @ np.asarray(vecs).T, dtype=np.float32)  # (n_accel, n_new)
+        new_ids = np.broadcast_to(np.arange(start, start + sims.shape[1], dtype=np.int64), sims.shape)
+        cand_scores = np.hstack([scores, sims])
+        cand_ids = np.hstack([ids, new_ids])
+        keep = top_k_rows(cand_scores, self.top_n)
+        return np.take_along_axis(cand_ids, keep, axis=1), np.take_along_axis(cand_scores, keep, axis=1)
+
+    def nbytes(self) -> int:
+        ids, scores = self.view
+        return ids.nbytes + scores.nbytes
+
+    def top(self, accel_idx: int, limit: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """(request ids, scores) for one accelerator, best first."""
+        ids, scores = self.view
+        if not 0 <= accel_idx < ids.shape[0]:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        row_ids, row_scores = ids[accel_idx], scores[accel_idx]
+        n = int(np.count_nonzero(row_ids >= 0))
+        if limit is not None:
+            n = min(n, max(int(limit), 0))
+        return row_ids[:n], row_scores[:n]
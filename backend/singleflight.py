@@ -0,0 +1,58 @@
+from threading import Event, Lock
+from typing import Any, Callable, Hashable
+
+# -------------------------------------------------
+# Single-flight call coalescing
+#
+# Concurrent callers that ask for the same key while a call is already
+# running wait for that call and share its result (or its exception)
+# instead of starting their own. Nothing is cached after the call ends.
+# -------------------------------------------------
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """
+        Run fn() once per in-flight key.
+        Returns (result, shared) where shared is True for callers that joined
+        someone else's call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -13,6 +13,8 @@ VENV_DIR=".venv"
 PYBIN="$(command -v python3.11 || command -v python3 || command -v python)"
 PORT="${PORT:-8000}"
 HOST="${HOST:-0.0.0.0}"
+# worker count; also tells ratelimit.py how to split GEMINI_RPM between workers
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-2}"
 
 echo "▶ Using Python: $PYBIN"
 echo "▶ Project root: $SCRIPT_DIR"
@@ -39,7 +41,7 @@ else
   echo "📦 Installing minimal dependencies ..."
   pip install --no-input \
     fastapi uvicorn[standard] gunicorn python-dotenv \
-    google-generativeai google-genai \
+    google-genai \
     numpy pandas charset-normalizer
 fi
 
@@ -64,10 +66,10 @@ mkdir -p data
 
 # --- info ---
 echo "✅ Environment ready."
-echo "ℹ️  First boot may take longer while embeddings/caches are built from:"
-echo "    - data/accelerators.csv"
-echo "    - data/u_hack.csv"
-echo "    - caches: data/*.npy / data/*_text.txt"
+echo "ℹ️  Workers load index artifacts built by: python build_index.py"
+echo "    - from data/accelerators.csv, data/u_hack.csv"
+echo "    - caches: data/*.npy / data/*_text.txt / data/index_meta.json"
+echo "    Missing/stale artifacts are rebuilt in the background; poll /ready."
 
 # --- run app ---
 # api.py defines: app = FastAPI(...)
@@ -75,7 +77,7 @@ echo "    - caches: data/*.npy / data/*_text.txt"
 echo "🚀 Starting Gunicorn (UvicornWorker) ..."
 exec gunicorn -k uvicorn.workers.UvicornWorker api:app \
   --bind "${HOST}:${PORT}" \
-  --workers 2 \
+  --workers "$WEB_CONCURRENCY" \
   --timeout 180 \
   --access-logfile - \
   --error-logfile -